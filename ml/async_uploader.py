@@ -0,0 +1,272 @@
+"""Motor de subida asíncrono hacia PostgREST (Supabase) con pool de conexiones.
+
+El cliente síncrono de supabase envía una petición a la vez, así que la red
+limita el throughput antes que el modelo. Este motor:
+
+- reutiliza conexiones con un ``httpx.AsyncClient`` (keep-alive, HTTP/2 si ``h2``
+  está instalado),
+- limita las peticiones simultáneas con un semáforo,
+- limita la tasa con un token bucket (peticiones por segundo),
+- ajusta el tamaño de lote (AIMD): crece mientras la latencia observada queda por
+  debajo del objetivo y se reduce a la mitad ante latencias altas, 429 o 5xx,
+- reintenta solo fallos en los que el servidor no pudo haber insertado el lote.
+
+Se puede probar de punta a punta contra ``mock_postgrest.py``:
+python ml/async_uploader.py --mock --rows 5000 --concurrency 16
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+import httpx
+
+# Los POST son inserciones simples (no idempotentes): un timeout de lectura o un 500/502/504
+# pueden llegar después de que el lote ya se confirmó, y reintentarlos duplicaría filas.
+# Solo se reintenta lo que ocurre antes de enviar la petición o que el servidor rechaza sin procesar.
+RETRYABLE_STATUS = {429, 503}
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class TokenBucket:
+    """Token bucket asíncrono: ``rate`` fichas por segundo con ráfagas de ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class AdaptiveBatchSize:
+    """Incremento aditivo / decremento multiplicativo según la latencia observada."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency_s: float, step: int) -> None:
+        self.value = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency_s = target_latency_s
+        self.step = step
+
+    def record(self, latency_s: float, ok: bool) -> None:
+        if not ok or latency_s > self.target_latency_s:
+            self.value = max(self.minimum, self.value // 2)
+        else:
+            self.value = min(self.maximum, self.value + self.step)
+
+
+@dataclass
+class UploadStats:
+    rows: int = 0
+    requests: int = 0
+    retries: int = 0
+    failed_rows: int = 0
+    latencies_s: list[float] = field(default_factory=list)
+    batch_sizes: list[int] = field(default_factory=list)
+
+    def summary(self, elapsed_s: float) -> dict[str, Any]:
+        latencies = sorted(self.latencies_s) or [0.0]
+        return {
+            "rows": self.rows,
+            "failed_rows": self.failed_rows,
+            "requests": self.requests,
+            "retries": self.retries,
+            "elapsed_s": elapsed_s,
+            "rows_per_s": self.rows / elapsed_s if elapsed_s > 0 else None,
+            "latency_p50_ms": latencies[len(latencies) // 2] * 1000,
+            "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+            "final_batch_size": self.batch_sizes[-1] if self.batch_sizes else None,
+        }
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # type: ignore  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class AsyncUploader:
+    """Inserta filas en una tabla de PostgREST con concurrencia y tasa acotadas."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        table: str = "producto_embeddings",
+        concurrency: int = 8,
+        rate_limit: float = 0.0,
+        initial_batch_size: int = 50,
+        min_batch_size: int = 1,
+        max_batch_size: int = 500,
+        target_latency_s: float = 0.5,
+        max_retries: int = 5,
+        timeout_s: float = 30.0,
+    ) -> None:
+        self.url = f"{base_url.rstrip('/')}/rest/v1/{table}"
+        self.headers = {
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal",
+        }
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate_limit)
+        self.batch_size = AdaptiveBatchSize(
+            initial_batch_size, min_batch_size, max_batch_size, target_latency_s, step=max(1, initial_batch_size // 5)
+        )
+        self.max_retries = max_retries
+        self.timeout_s = timeout_s
+        self.stats = UploadStats()
+
+    def _client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        return httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=limits,
+            headers=self.headers,
+            timeout=self.timeout_s,
+        )
+
+    async def _post(self, client: httpx.AsyncClient, rows: list[dict[str, Any]]) -> None:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            t0 = time.perf_counter()
+            try:
+                response = await client.post(self.url, content=json.dumps(rows))
+                ok = response.status_code < 300
+                retryable = response.status_code in RETRYABLE_STATUS
+                error = None if ok else f"HTTP {response.status_code}: {response.text[:200]}"
+            except httpx.TransportError as exc:
+                ok, retryable, error = False, isinstance(exc, RETRYABLE_ERRORS), f"{type(exc).__name__}: {exc}"
+            latency = time.perf_counter() - t0
+
+            self.stats.requests += 1
+            self.stats.latencies_s.append(latency)
+            self.batch_size.record(latency, ok)
+            if ok:
+                self.stats.rows += len(rows)
+                return
+            if not retryable or attempt == self.max_retries:
+                break
+            self.stats.retries += 1
+            await asyncio.sleep(min(10.0, 0.2 * 2**attempt))
+
+        self.stats.failed_rows += len(rows)
+        print(f"  -> Error al subir lote de {len(rows)} embeddings: {error}")
+
+    async def upload(self, rows: AsyncIterator[dict[str, Any]]) -> dict[str, Any]:
+        """Consume ``rows`` y las envía en lotes de tamaño adaptativo."""
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: set[asyncio.Task] = set()
+
+        async def send(batch: list[dict[str, Any]]) -> None:
+            try:
+                await self._post(client, batch)
+            finally:
+                semaphore.release()
+
+        async with self._client() as client:
+            try:
+                batch: list[dict[str, Any]] = []
+                async for row in rows:
+                    batch.append(row)
+                    if len(batch) >= self.batch_size.value:
+                        await semaphore.acquire()
+                        self.stats.batch_sizes.append(len(batch))
+                        task = asyncio.create_task(send(batch))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                        batch = []
+                if batch:
+                    await semaphore.acquire()
+                    self.stats.batch_sizes.append(len(batch))
+                    pending.add(asyncio.create_task(send(batch)))
+                if pending:
+                    await asyncio.gather(*pending)
+            finally:
+                # Si la fuente falla, los envíos en curso se cancelan y se esperan antes de
+                # cerrar el cliente, para no dejar tareas usando conexiones cerradas.
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        return self.stats.summary(time.perf_counter() - started)
+
+
+async def iterate_in_thread(source: Iterable[Any]) -> AsyncIterator[Any]:
+    """Adapta un iterador bloqueante (p. ej. el pipeline de embeddings) al bucle asyncio."""
+    done = object()
+    iterator: Iterator[Any] = iter(source)
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def synthetic_rows(count: int, dim: int) -> Iterator[dict[str, Any]]:
+    for index in range(count):
+        yield {"productoId": index % 1000 + 1, "embedding": [0.0] * dim, "fuente": f"synthetic-{index}.jpg"}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga del motor de subida asíncrono.")
+    parser.add_argument("--url", type=str, help="URL base de Supabase/PostgREST")
+    parser.add_argument("--key", type=str, default="test-key")
+    parser.add_argument("--mock", action="store_true", help="Levanta mock_postgrest.py local y sube contra él")
+    parser.add_argument("--mock_latency_ms", type=float, default=20.0)
+    parser.add_argument("--mock_failure_rate", type=float, default=0.0)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate_limit", type=float, default=0.0, help="Peticiones por segundo (0 = sin límite)")
+    parser.add_argument("--batch_size", type=int, default=50)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if args.mock:
+        from mock_postgrest import start_mock_server
+
+        server = start_mock_server(latency_ms=args.mock_latency_ms, failure_rate=args.mock_failure_rate)
+        base_url = server.base_url
+    if not base_url:
+        parser.error("Indica --url o usa --mock")
+
+    uploader = AsyncUploader(
+        base_url,
+        args.key,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+        initial_batch_size=args.batch_size,
+    )
+    summary = asyncio.run(uploader.upload(iterate_in_thread(synthetic_rows(args.rows, args.dim))))
+    if server is not None:
+        summary["server_rows"] = len(server.state.tables.get("producto_embeddings", []))
+        server.shutdown()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compara la decodificación con ``tf.keras.utils.load_img`` frente a ``image_io``.
+
+Mide el tiempo de decodificación por imagen de ambos caminos y, si se indica un
+modelo, la deriva de los embeddings (similitud coseno entre el embedding de la
+ruta anterior y el de la nueva para cada imagen).
+
+Uso:
+python ml/benchmark_image_io.py --images data/val --model exports/20251109-001619 --limit 200
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from image_io import LOADER_NAME, load_image_array
+from matching_system import ALLOWED_EXTENSIONS, ShoeMatchingSystem
+
+
+def legacy_load_array(path: pathlib.Path) -> np.ndarray:
+    return tf.keras.utils.img_to_array(tf.keras.utils.load_img(path, target_size=(224, 224)))
+
+
+def time_loader(loader, paths: list[pathlib.Path]) -> tuple[np.ndarray, list[float]]:
+    arrays = []
+    samples_ms = []
+    for path in paths:
+        t0 = time.perf_counter()
+        arrays.append(loader(path))
+        samples_ms.append((time.perf_counter() - t0) * 1000)
+    return np.stack(arrays).astype(np.float32), samples_ms
+
+
+def summarize(samples_ms: list[float]) -> dict[str, float]:
+    values = np.asarray(samples_ms)
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de decodificación JPEG y deriva de embeddings.")
+    parser.add_argument("--images", type=pathlib.Path, required=True, help="Carpeta con imágenes de prueba")
+    parser.add_argument("--model", type=pathlib.Path, help="Export para medir la deriva de embeddings")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--output", type=pathlib.Path, help="Ruta opcional del reporte JSON")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in args.images.rglob("*") if p.suffix.lower() in ALLOWED_EXTENSIONS)[: args.limit]
+    if not paths:
+        parser.error(f"No se encontraron imágenes en {args.images}")
+
+    # Calentamiento para no contar la inicialización de TensorFlow/PIL.
+    legacy_load_array(paths[0])
+    load_image_array(paths[0])
+
+    legacy_batch, legacy_ms = time_loader(legacy_load_array, paths)
+    fast_batch, fast_ms = time_loader(load_image_array, paths)
+
+    report: dict[str, object] = {
+        "images": len(paths),
+        "legacy": summarize(legacy_ms),
+        LOADER_NAME: summarize(fast_ms),
+        "speedup": float(np.mean(legacy_ms) / np.mean(fast_ms)),
+        "pixel_mae": float(np.mean(np.abs(legacy_batch - fast_batch))),
+    }
+
+    if args.model:
+        matcher = ShoeMatchingSystem(args.model, args.images)
+        preprocess = tf.keras.applications.mobilenet_v2.preprocess_input
+        legacy_embeddings = []
+        fast_embeddings = []
+        for start in range(0, len(paths), args.batch_size):
+            end = start + args.batch_size
+            legacy_embeddings.append(matcher.embed_batch(preprocess(legacy_batch[start:end].copy())))
+            fast_embeddings.append(matcher.embed_batch(preprocess(fast_batch[start:end].copy())))
+        cosine = np.sum(np.concatenate(legacy_embeddings) * np.concatenate(fast_embeddings), axis=1)
+        report["embedding_cosine"] = {
+            "mean": float(cosine.mean()),
+            "min": float(cosine.min()),
+            "p5": float(np.percentile(cosine, 5)),
+        }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
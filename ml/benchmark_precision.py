@@ -0,0 +1,166 @@
+"""Mide tiempo por paso y paridad de embeddings entre precisiones y XLA en CPU.
+
+Toma como referencia el modelo float32 de un export (``--model``), reconstruye su
+arquitectura bajo cada política ``mixed_float16``/``mixed_bfloat16`` con y sin
+``jit_compile``, le copia los pesos del export y compara:
+
+- tiempo por paso de entrenamiento (``train_on_batch``),
+- tiempo de inferencia del modelo de embeddings por lote,
+- similitud coseno de los embeddings frente a float32.
+
+Sin ``--model`` se usa ``build_model`` recién construido (proyección aleatoria),
+útil solo para comparar tiempos.
+
+Uso:
+python ml/benchmark_precision.py --model exports/20251109-001619 --batch_size 32 --steps 20 --output reports/precision.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from model_registry import find_model_file, load_keras_model
+from train_mobilenet import DEFAULT_IMG_SIZE, PRECISION_POLICIES, build_model, build_student_model
+
+
+def build_variant(
+    precision: str,
+    num_classes: int,
+    embedding_dim: int,
+    img_size: tuple[int, int],
+    backbone: str | None = None,
+):
+    """Construye modelo de entrenamiento y de embeddings bajo la política ``precision``.
+
+    Con ``backbone`` (exports destilados) se usa la arquitectura del estudiante y
+    se le añade un clasificador solo para medir el paso de entrenamiento.
+    """
+    tf.keras.backend.clear_session()
+    tf.keras.mixed_precision.set_global_policy(precision)
+    if backbone is None:
+        return build_model(num_classes, img_size, dropout=0.0, embedding_dim=embedding_dim, projection_regularizer=0.0)
+    embedding_model = build_student_model(
+        backbone, img_size, dropout=0.0, embedding_dim=embedding_dim, projection_regularizer=0.0
+    )
+    logits = tf.keras.layers.Dense(num_classes, activation="softmax", name="classifier", dtype="float32")(
+        embedding_model.output
+    )
+    return tf.keras.Model(embedding_model.input, logits), embedding_model
+
+
+def load_reference(model: pathlib.Path) -> tuple[tf.keras.Model, dict[str, object]]:
+    """Carga el modelo float32 de un export y su ``metadata.json``."""
+    model_file = find_model_file(model) if model.is_dir() else model
+    metadata_path = model_file.parent / "metadata.json"
+    metadata = json.loads(metadata_path.read_text(encoding="utf-8")) if metadata_path.exists() else {}
+    tf.keras.mixed_precision.set_global_policy("float32")
+    print(f"Cargando modelo de referencia desde {model_file}")
+    return load_keras_model(model_file), metadata
+
+
+def time_calls(fn, steps: int) -> list[float]:
+    fn()  # calentamiento / trazado del grafo o compilación XLA
+    samples_ms = []
+    for _ in range(steps):
+        t0 = time.perf_counter()
+        fn()
+        samples_ms.append((time.perf_counter() - t0) * 1000)
+    return samples_ms
+
+
+def summarize(samples_ms: list[float]) -> dict[str, float]:
+    values = np.asarray(samples_ms)
+    return {"mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50))}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de precisión mixta y XLA en CPU.")
+    parser.add_argument(
+        "--model",
+        type=pathlib.Path,
+        help="Export (carpeta o archivo) cuyo modelo float32 se usa como referencia y fuente de pesos",
+    )
+    parser.add_argument("--precisions", nargs="+", choices=PRECISION_POLICIES, default=list(PRECISION_POLICIES))
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--num_classes", type=int, default=10)
+    parser.add_argument("--embedding_dim", type=int, default=256, help="Solo sin --model")
+    parser.add_argument("--output", type=pathlib.Path, help="Ruta opcional del reporte JSON")
+    args = parser.parse_args()
+
+    backbone: str | None = None
+    if args.model is not None:
+        if not args.model.exists():
+            parser.error(f"El modelo '{args.model}' no existe.")
+        reference_model, metadata = load_reference(args.model)
+        img_size = tuple(int(v) for v in reference_model.input_shape[1:3])
+        embedding_dim = int(reference_model.output_shape[-1])
+        backbone = metadata.get("backbone")
+    else:
+        img_size = DEFAULT_IMG_SIZE
+        embedding_dim = args.embedding_dim
+        _, reference_model = build_variant("float32", args.num_classes, embedding_dim, img_size)
+
+    rng = np.random.default_rng(0)
+    images = rng.uniform(0, 255, size=(args.batch_size,) + img_size + (3,)).astype(np.float32)
+    labels = tf.keras.utils.to_categorical(rng.integers(0, args.num_classes, args.batch_size), args.num_classes)
+
+    reference_weights = reference_model.get_weights()
+    reference_embeddings = np.asarray(reference_model(images, training=False), dtype=np.float32)
+
+    results = []
+    for precision in args.precisions:
+        for jit_compile in (False, True):
+            training_model, embedding_model = build_variant(
+                precision, args.num_classes, embedding_dim, img_size, backbone
+            )
+            try:
+                embedding_model.set_weights(reference_weights)
+            except ValueError as exc:
+                raise SystemExit(
+                    f"La arquitectura reconstruida no coincide con el export {args.model}: {exc}"
+                ) from exc
+            training_model.compile(
+                optimizer=tf.keras.optimizers.AdamW(learning_rate=1e-4),
+                loss="categorical_crossentropy",
+                jit_compile=jit_compile,
+            )
+            infer = tf.function(lambda x: embedding_model(x, training=False), jit_compile=jit_compile)
+
+            embeddings = np.asarray(infer(tf.constant(images)), dtype=np.float32)
+            cosine = np.sum(reference_embeddings * embeddings, axis=1)
+            result = {
+                "precision": precision,
+                "jit_compile": jit_compile,
+                "train_step": summarize(time_calls(lambda: training_model.train_on_batch(images, labels), args.steps)),
+                "inference_batch": summarize(time_calls(lambda: infer(tf.constant(images)), args.steps)),
+                "embedding_dtype": str(embeddings.dtype),
+                "cosine_vs_float32": {"mean": float(cosine.mean()), "min": float(cosine.min())},
+            }
+            results.append(result)
+            print(
+                f"{precision:>15} jit={jit_compile!s:<5} paso={result['train_step']['mean_ms']:.1f} ms"
+                f" inferencia={result['inference_batch']['mean_ms']:.1f} ms"
+                f" coseno_min={result['cosine_vs_float32']['min']:.5f}"
+            )
+
+    tf.keras.mixed_precision.set_global_policy("float32")
+    report = {
+        "model": str(args.model) if args.model is not None else None,
+        "batch_size": args.batch_size,
+        "steps": args.steps,
+        "results": results,
+    }
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Reporte guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
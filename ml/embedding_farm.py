@@ -0,0 +1,209 @@
+"""Granja de procesos para extraer embeddings aprovechando CPUs de muchos núcleos.
+
+Un solo bucle ``predict`` de Keras deja ociosa buena parte de los núcleos en
+hosts sin GPU. La granja arranca N procesos, cada uno con su propia copia del
+modelo y con ``intra_op``/``inter_op`` ajustados para no competir entre sí, y
+reparte el trabajo por bloques. Cada bloque regresa con su desplazamiento, así
+los resultados se escriben en orden en el arreglo de salida (en memoria o
+``.npy`` mapeado) sin importar qué proceso termine primero.
+
+``autotune`` prueba varias combinaciones de procesos/hilos sobre una muestra de
+imágenes y devuelve la que logra más imágenes por segundo en la máquina actual.
+Cada proceso ejecuta una inferencia de calentamiento al arrancar y la medición
+empieza cuando todos están listos, con bloques suficientes para ocuparlos a todos.
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import pathlib
+import time
+from dataclasses import asdict, dataclass
+from itertools import cycle, islice
+from typing import Iterator, Sequence
+
+import numpy as np
+
+_MODEL = None
+_PREDICT = None
+
+
+@dataclass(frozen=True)
+class FarmConfig:
+    workers: int
+    intra_op_threads: int
+    inter_op_threads: int = 1
+
+    @classmethod
+    def for_workers(cls, workers: int, cpu_count: int | None = None) -> "FarmConfig":
+        cpu_count = cpu_count or os.cpu_count() or 1
+        workers = max(1, min(workers, cpu_count))
+        return cls(workers=workers, intra_op_threads=max(1, cpu_count // workers))
+
+
+def _init_worker(
+    model_path: str,
+    intra_op_threads: int,
+    inter_op_threads: int,
+    jit_compile: bool,
+    warmup_batch_size: int,
+    ready,
+) -> None:
+    # Los hilos de TensorFlow deben configurarse antes de ejecutar cualquier operación.
+    import tensorflow as tf
+
+    from model_registry import load_keras_model
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    global _MODEL
+    _MODEL = load_keras_model(model_path)
+
+    global _PREDICT
+    if jit_compile:
+        _PREDICT = tf.function(lambda batch: _MODEL(batch, training=False), jit_compile=True)
+    else:
+        _PREDICT = _MODEL.predict_on_batch
+
+    # Una inferencia con el tamaño de bloque habitual crea el grafo (y compila XLA)
+    # antes de recibir trabajo; luego se avisa al proceso padre.
+    warmup = np.zeros((warmup_batch_size, *_MODEL.input_shape[1:]), dtype=np.float32)
+    _PREDICT(tf.convert_to_tensor(warmup))
+    ready.release()
+
+
+def _embed_chunk(task: tuple[int, list[str]]) -> tuple[int, np.ndarray]:
+    import tensorflow as tf
+
+    from image_io import load_image_batch
+
+    start, paths = task
+    batch = tf.keras.applications.mobilenet_v2.preprocess_input(load_image_batch(paths))
+    embeddings = np.asarray(_PREDICT(tf.convert_to_tensor(batch, dtype=tf.float32)), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+    return start, embeddings
+
+
+class EmbeddingFarm:
+    """Pool de procesos con un modelo cargado por proceso."""
+
+    def __init__(
+        self,
+        model_path: str | pathlib.Path,
+        config: FarmConfig,
+        jit_compile: bool = False,
+        warmup_batch_size: int = 32,
+    ) -> None:
+        self.model_path = str(model_path)
+        self.config = config
+        # "spawn" evita heredar el estado de TensorFlow del proceso padre.
+        context = mp.get_context("spawn")
+        self._ready = context.Semaphore(0)
+        self._pool = context.Pool(
+            processes=config.workers,
+            initializer=_init_worker,
+            initargs=(
+                self.model_path,
+                config.intra_op_threads,
+                config.inter_op_threads,
+                jit_compile,
+                warmup_batch_size,
+                self._ready,
+            ),
+        )
+
+    def __enter__(self) -> "EmbeddingFarm":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def wait_ready(self) -> None:
+        """Bloquea hasta que todos los procesos cargaron el modelo y terminaron su calentamiento."""
+        for _ in range(self.config.workers):
+            self._ready.acquire()
+
+    def close(self) -> None:
+        self._pool.terminate()
+        self._pool.join()
+
+    def embed(
+        self,
+        paths: Sequence[str | pathlib.Path],
+        chunk_size: int = 32,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Embebe ``paths`` y escribe cada fila en su posición dentro de ``out``."""
+        tasks: Iterator[tuple[int, list[str]]] = (
+            (start, [str(p) for p in paths[start : start + chunk_size]])
+            for start in range(0, len(paths), chunk_size)
+        )
+        for start, embeddings in self._pool.imap_unordered(_embed_chunk, tasks):
+            if out is None:
+                out = np.empty((len(paths), embeddings.shape[1]), dtype=np.float32)
+            out[start : start + len(embeddings)] = embeddings
+        if out is None:
+            raise ValueError("No hay imágenes para embeber")
+        return out
+
+
+def open_output_store(path: str | pathlib.Path, count: int, dim: int) -> np.ndarray:
+    """Crea un ``.npy`` mapeado en disco donde los procesos escriben sus resultados."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(count, dim))
+
+
+def candidate_configs(cpu_count: int | None = None) -> list[FarmConfig]:
+    """Combinaciones de procesos x hilos que ocupan todos los núcleos disponibles."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    configs = []
+    workers = 1
+    while workers <= cpu_count:
+        intra = max(1, cpu_count // workers)
+        configs.append(FarmConfig(workers=workers, intra_op_threads=intra, inter_op_threads=1))
+        if intra >= 4:
+            configs.append(FarmConfig(workers=workers, intra_op_threads=intra, inter_op_threads=2))
+        workers *= 2
+    return configs
+
+
+def autotune(
+    model_path: str | pathlib.Path,
+    sample_paths: Sequence[str | pathlib.Path],
+    chunk_size: int = 32,
+    candidates: Sequence[FarmConfig] | None = None,
+    jit_compile: bool = False,
+    chunks_per_worker: int = 4,
+) -> tuple[FarmConfig, list[dict[str, object]]]:
+    """Mide imágenes/segundo de cada configuración y devuelve la más rápida.
+
+    La muestra se repite hasta cubrir al menos ``chunks_per_worker`` bloques por
+    proceso (en bloques completos), para que las configuraciones con muchos
+    procesos no se midan con la mayoría ociosos.
+    """
+    if not sample_paths:
+        raise ValueError("Se requieren imágenes de muestra para el autoajuste")
+
+    results: list[dict[str, object]] = []
+    best: FarmConfig | None = None
+    best_rate = 0.0
+    for config in candidates or candidate_configs():
+        chunks = max(-(-len(sample_paths) // chunk_size), config.workers * chunks_per_worker)
+        measured = list(islice(cycle(sample_paths), chunks * chunk_size))
+        with EmbeddingFarm(model_path, config, jit_compile, warmup_batch_size=chunk_size) as farm:
+            farm.wait_ready()
+            t0 = time.perf_counter()
+            farm.embed(measured, chunk_size)
+            rate = len(measured) / (time.perf_counter() - t0)
+        results.append({**asdict(config), "images_per_s": rate})
+        print(
+            f"  {config.workers} procesos x {config.intra_op_threads} hilos"
+            f" (inter {config.inter_op_threads}): {rate:.1f} img/s"
+        )
+        if rate > best_rate:
+            best, best_rate = config, rate
+
+    assert best is not None
+    return best, results
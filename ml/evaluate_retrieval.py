@@ -0,0 +1,305 @@
+"""Evalúa la recuperación visual (recall@k, mAP y latencias) usando data/val como consultas.
+
+Construye el índice de ``data/train`` con cada export indicado, embebe las
+imágenes de ``data/val`` por lotes y las busca con cada backend de búsqueda.
+Una consulta acierta cuando el producto recuperado pertenece a su misma clase
+(subcarpeta). El resultado es un reporte JSON comparable entre exports y backends.
+
+Uso:
+python ml/evaluate_retrieval.py --model exports/20251109-001619 --backends exact int8 ivf --tta_views 1 4
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Sequence
+
+import numpy as np
+
+import tensorflow as tf
+
+from image_io import TTA_VIEWS, load_tta_views
+from matching_system import ALLOWED_EXTENSIONS, ShoeMatchingSystem
+from search_backends import BACKENDS, create_backend
+
+
+def collect_labeled_images(root: pathlib.Path) -> tuple[list[pathlib.Path], list[str]]:
+    """Devuelve rutas de imagen y la clase (primera subcarpeta bajo ``root``)."""
+    paths: list[pathlib.Path] = []
+    labels: list[str] = []
+    for path in sorted(root.rglob("*")):
+        if path.suffix.lower() not in ALLOWED_EXTENSIONS:
+            continue
+        relative = path.relative_to(root)
+        if len(relative.parts) < 2:
+            continue
+        paths.append(path)
+        labels.append(relative.parts[0])
+    return paths, labels
+
+
+def gallery_labels(matcher: ShoeMatchingSystem, root: pathlib.Path) -> list[str]:
+    resolved_root = root.resolve()
+    labels = []
+    for meta in matcher.metadata:
+        relative = pathlib.Path(meta["path"]).relative_to(resolved_root)
+        labels.append(relative.parts[0] if len(relative.parts) > 1 else "")
+    return labels
+
+
+def latency_summary(samples_ms: Sequence[float]) -> dict[str, float]:
+    if not samples_ms:
+        return {}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def embed_queries(
+    matcher: ShoeMatchingSystem,
+    paths: Sequence[pathlib.Path],
+    batch_size: int,
+    tta_views: int = 1,
+    single_query_samples: int = 20,
+) -> tuple[np.ndarray, dict[str, object]]:
+    """Embebe las consultas por lotes midiendo decodificación e inferencia por separado.
+
+    Con ``tta_views > 1`` las vistas de cada consulta se apilan en el mismo lote y
+    sus embeddings se promedian y renormalizan, igual que ``embed_query``.
+    """
+    decode_ms: list[float] = []
+    model_ms: list[float] = []
+    chunks: list[np.ndarray] = []
+    started = time.perf_counter()
+    for start in range(0, len(paths), batch_size):
+        batch_paths = paths[start : start + batch_size]
+        t0 = time.perf_counter()
+        if tta_views > 1:
+            views = np.concatenate([load_tta_views(path, tta_views) for path in batch_paths])
+            batch = tf.keras.applications.mobilenet_v2.preprocess_input(views)
+        else:
+            batch = matcher.preprocess_images(batch_paths)
+        t1 = time.perf_counter()
+        embeddings = matcher.embed_batch(batch)
+        if tta_views > 1:
+            embeddings = embeddings.reshape(len(batch_paths), -1, embeddings.shape[-1]).mean(axis=1)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+        chunks.append(embeddings)
+        t2 = time.perf_counter()
+        decode_ms.append((t1 - t0) * 1000 / len(batch_paths))
+        model_ms.append((t2 - t1) * 1000 / len(batch_paths))
+    total_s = time.perf_counter() - started
+
+    # Latencia de una consulta aislada (lo que percibe find_similar), con TTA incluido.
+    single_ms: list[float] = []
+    for path in paths[:single_query_samples]:
+        t0 = time.perf_counter()
+        matcher.embed_query(path, tta_views)
+        single_ms.append((time.perf_counter() - t0) * 1000)
+
+    timings = {
+        "batch_size": batch_size,
+        "tta_views": tta_views,
+        "decode_per_image": latency_summary(decode_ms),
+        "model_per_image": latency_summary(model_ms),
+        "single_query": latency_summary(single_ms),
+        "total_s": total_s,
+    }
+    return np.concatenate(chunks, axis=0), timings
+
+
+def average_precision(hits: np.ndarray, num_relevant: int) -> float:
+    """AP sobre la lista recuperada, normalizado por min(relevantes, profundidad)."""
+    denominator = min(num_relevant, hits.size)
+    if denominator == 0:
+        return 0.0
+    cumulative = np.cumsum(hits)
+    precision_at_hit = cumulative[hits] / (np.flatnonzero(hits) + 1)
+    return float(precision_at_hit.sum() / denominator)
+
+
+def retrieval_metrics(
+    retrieved: np.ndarray,
+    query_labels: Sequence[str],
+    index_labels: Sequence[str],
+    ks: Sequence[int],
+) -> dict[str, object]:
+    index_labels_arr = np.asarray(index_labels)
+    relevant_counts = defaultdict(int)
+    for label in index_labels:
+        relevant_counts[label] += 1
+
+    per_class: dict[str, dict[str, list[float]]] = defaultdict(lambda: defaultdict(list))
+    for row, label in enumerate(query_labels):
+        ids = retrieved[row]
+        ids = ids[ids >= 0]
+        hits = index_labels_arr[ids] == label
+        for k in ks:
+            per_class[label][f"recall@{k}"].append(float(hits[:k].any()))
+        per_class[label]["ap"].append(average_precision(hits, relevant_counts[label]))
+
+    metric_names = [f"recall@{k}" for k in ks]
+    classes_report = {}
+    for label, values in sorted(per_class.items()):
+        classes_report[label] = {name: float(np.mean(values[name])) for name in metric_names}
+        classes_report[label]["mAP"] = float(np.mean(values["ap"]))
+        classes_report[label]["queries"] = len(values["ap"])
+
+    overall = {
+        name: float(np.mean([v for values in per_class.values() for v in values[name]]))
+        for name in metric_names
+    }
+    overall["mAP"] = float(np.mean([v for values in per_class.values() for v in values["ap"]]))
+    overall["macro_mAP"] = float(np.mean([c["mAP"] for c in classes_report.values()]))
+    return {"overall": overall, "per_class": classes_report}
+
+
+def evaluate_backend(
+    name: str,
+    gallery: np.ndarray,
+    queries: np.ndarray,
+    query_labels: Sequence[str],
+    index_labels: Sequence[str],
+    ks: Sequence[int],
+    depth: int,
+    options: dict[str, object],
+) -> dict[str, object]:
+    t0 = time.perf_counter()
+    backend = create_backend(name, gallery, **options)
+    build_s = time.perf_counter() - t0
+
+    search_ms: list[float] = []
+    retrieved = np.full((len(queries), depth), -1, dtype=np.int64)
+    for row, query in enumerate(queries):
+        t0 = time.perf_counter()
+        _, indices = backend.search(query, depth)
+        search_ms.append((time.perf_counter() - t0) * 1000)
+        retrieved[row, : indices.shape[1]] = indices[0]
+
+    t0 = time.perf_counter()
+    backend.search(queries, depth)
+    batched_s = time.perf_counter() - t0
+
+    report = retrieval_metrics(retrieved, query_labels, index_labels, ks)
+    report["latency"] = {
+        "build_s": build_s,
+        "search_per_query": latency_summary(search_ms),
+        "batched_queries_per_s": float(len(queries) / batched_s) if batched_s > 0 else None,
+    }
+    report["index_bytes"] = backend.nbytes
+    report["options"] = options
+    return report
+
+
+def evaluate_export(args: argparse.Namespace, model: pathlib.Path) -> dict[str, object]:
+    with tempfile.TemporaryDirectory(prefix="stockwear-eval-") as index_dir:
+        matcher = ShoeMatchingSystem(
+            model, args.train, embeddings_output_path=index_dir, verify_checksum=False
+        )
+
+        t0 = time.perf_counter()
+        # Índice temporal: no debe quedar registrado como el índice del export.
+        matcher.build_inventory_embeddings(batch_size=args.batch_size, overwrite=True, register=False)
+        index_build_s = time.perf_counter() - t0
+        gallery = np.array(matcher.embedding_matrix, dtype=np.float32)
+        index_labels = gallery_labels(matcher, args.train)
+
+        query_paths, query_labels = collect_labeled_images(args.val)
+        if not query_paths:
+            raise SystemExit(f"No se encontraron imágenes de consulta en {args.val}")
+        embedded_runs = [
+            (tta_views, *embed_queries(matcher, query_paths, args.batch_size, tta_views))
+            for tta_views in args.tta_views
+        ]
+
+    depth = min(max(max(args.ks), args.map_depth), len(gallery))
+    backend_options = {
+        "exact": {},
+        "int8": {},
+        "ivf": {"nlist": args.nlist, "nprobe": args.nprobe},
+    }
+    runs = []
+    for tta_views, queries, query_timings in embedded_runs:
+        backends = {}
+        for name in args.backends:
+            print(f"Evaluando backend '{name}' con {len(queries)} consultas (TTA {tta_views} vistas)...")
+            backends[name] = evaluate_backend(
+                name,
+                gallery,
+                queries,
+                query_labels,
+                index_labels,
+                args.ks,
+                depth,
+                backend_options.get(name, {}),
+            )
+            overall = backends[name]["overall"]
+            print("  " + ", ".join(f"{key}={value:.4f}" for key, value in overall.items()))
+        runs.append({"tta_views": tta_views, "query_embedding": query_timings, "backends": backends})
+
+    return {
+        "model": str(model),
+        "export_metadata": matcher.export_metadata,
+        "embedding_dim": matcher.embedding_dim,
+        "gallery_size": int(len(gallery)),
+        "query_count": len(query_paths),
+        "map_depth": depth,
+        "index_build_s": index_build_s,
+        "runs": runs,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Evalúa recall@k, mAP y latencia de find_similar.")
+    parser.add_argument("--model", type=pathlib.Path, nargs="+", required=True, help="Uno o más exports a comparar")
+    parser.add_argument("--train", type=pathlib.Path, default=pathlib.Path("data") / "train", help="Galería indexada")
+    parser.add_argument("--val", type=pathlib.Path, default=pathlib.Path("data") / "val", help="Imágenes de consulta")
+    parser.add_argument("--backends", nargs="+", default=["exact"], choices=sorted(BACKENDS))
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--map_depth", type=int, default=100, help="Profundidad de la lista usada para mAP")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--nlist", type=int, default=None, help="Listas del backend ivf (por defecto sqrt(N))")
+    parser.add_argument("--nprobe", type=int, default=8, help="Listas escaneadas por consulta en ivf")
+    parser.add_argument(
+        "--tta_views",
+        type=int,
+        nargs="+",
+        default=[1],
+        choices=range(1, len(TTA_VIEWS) + 1),
+        help="Vistas TTA por consulta a comparar (p. ej. 1 2 4)",
+    )
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        default=pathlib.Path("reports") / f"retrieval-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    args = parser.parse_args()
+
+    for directory in (args.train, args.val):
+        if not directory.exists():
+            parser.error(f"No se encontró el directorio {directory}")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "train": str(args.train),
+        "val": str(args.val),
+        "ks": args.ks,
+        "exports": [evaluate_export(args, model) for model in args.model],
+    }
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Reporte guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
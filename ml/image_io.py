@@ -0,0 +1,93 @@
+"""Carga rápida de imágenes para la ingesta de embeddings.
+
+Las fotos de teléfono (12 MP o más) se decodifican a tamaño completo con
+``tf.keras.utils.load_img`` solo para reducirlas después a 224x224. Para JPEG,
+``Image.draft`` pide a libjpeg que escale en el dominio DCT (1/2, 1/4 o 1/8)
+durante la decodificación, lo que evita reconstruir millones de píxeles que se
+descartarían al redimensionar. Además se respeta la orientación EXIF, que
+``load_img`` ignora.
+"""
+from __future__ import annotations
+
+import pathlib
+from typing import Sequence
+
+import numpy as np
+from PIL import Image, ImageOps
+
+DEFAULT_TARGET_SIZE = (224, 224)
+LOADER_NAME = "pil-draft-bilinear"
+
+_RESAMPLING = getattr(Image, "Resampling", Image)
+
+
+def load_image(
+    path: str | pathlib.Path,
+    target_size: tuple[int, int] = DEFAULT_TARGET_SIZE,
+) -> Image.Image:
+    """Abre ``path`` como RGB de tamaño ``target_size`` (alto, ancho)."""
+    height, width = target_size
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            # La orientación EXIF puede intercambiar ancho y alto, así que se pide
+            # el lado mayor en ambos ejes; draft nunca baja de lo solicitado.
+            side = max(height, width)
+            img.draft("RGB", (side, side))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size != (width, height):
+            img = img.resize((width, height), _RESAMPLING.BILINEAR)
+        else:
+            img.load()
+        return img
+
+
+def load_image_array(
+    path: str | pathlib.Path,
+    target_size: tuple[int, int] = DEFAULT_TARGET_SIZE,
+) -> np.ndarray:
+    """Devuelve la imagen como arreglo float32 (alto, ancho, 3) en rango [0, 255]."""
+    return np.asarray(load_image(path, target_size), dtype=np.float32)
+
+
+def load_image_batch(
+    paths: Sequence[str | pathlib.Path],
+    target_size: tuple[int, int] = DEFAULT_TARGET_SIZE,
+) -> np.ndarray:
+    """Apila varias imágenes en un lote float32 (n, alto, ancho, 3)."""
+    batch = np.empty((len(paths), target_size[0], target_size[1], 3), dtype=np.float32)
+    for row, path in enumerate(paths):
+        batch[row] = load_image_array(path, target_size)
+    return batch
+
+
+TTA_VIEWS = ("full", "flip", "crop90", "crop80", "crop90_flip", "crop80_flip")
+
+
+def load_tta_views(
+    path: str | pathlib.Path,
+    views: int,
+    target_size: tuple[int, int] = DEFAULT_TARGET_SIZE,
+) -> np.ndarray:
+    """Genera las primeras ``views`` vistas de ``TTA_VIEWS`` como lote (views, alto, ancho, 3).
+
+    La imagen se decodifica una sola vez con margen suficiente para el recorte más
+    cerrado (80 %), de modo que los recortes centrales no pierden resolución.
+    """
+    views = max(1, min(views, len(TTA_VIEWS)))
+    height, width = target_size
+    base = load_image(path, (int(np.ceil(height / 0.8)), int(np.ceil(width / 0.8))))
+    base_width, base_height = base.size
+
+    batch = np.empty((views, height, width, 3), dtype=np.float32)
+    for row, name in enumerate(TTA_VIEWS[:views]):
+        scale = {"crop90": 0.9, "crop80": 0.8}.get(name.split("_")[0], 1.0)
+        crop_w, crop_h = base_width * scale, base_height * scale
+        left, top = (base_width - crop_w) / 2, (base_height - crop_h) / 2
+        view = base.crop((round(left), round(top), round(left + crop_w), round(top + crop_h)))
+        view = view.resize((width, height), _RESAMPLING.BILINEAR)
+        if name.endswith("flip"):
+            view = ImageOps.mirror(view)
+        batch[row] = np.asarray(view, dtype=np.float32)
+    return batch
@@ -0,0 +1,403 @@
+"""Instantáneas versionadas e inmutables del índice de inventario.
+
+Cada reconstrucción del índice se publica en su propia carpeta dentro de la raíz
+(``data/index/<versión>/``) y nunca se modifica después. Un archivo ``CURRENT``
+apunta a la versión activa y se reemplaza de forma atómica con ``os.replace``,
+de modo que un proceso lector ve siempre la instantánea anterior completa o la
+nueva completa, nunca una mezcla a medio escribir.
+
+Cada instantánea es un único archivo ``index.swidx``::
+
+    b"SWIDX001" | uint32 LE longitud del encabezado | encabezado JSON | relleno
+    bloque de vectores (alineado a 64 bytes, float32 C-contiguo) | relleno
+    metadata: (cantidad + 1) desplazamientos uint64 LE | registros JSON compactos UTF-8
+
+El encabezado guarda huella del modelo, dimensión, dtype, cantidad, si los
+vectores están normalizados, desplazamientos/tamaños de cada bloque y el sha256
+de vectores + metadata. La carga valida solo el encabezado y mapea vectores y
+metadata con ``np.memmap``: cada registro se decodifica al pedirlo, así el costo
+de carga no depende de la cantidad de productos. La verificación completa del
+checksum es opcional y puede correr en un hilo de fondo. Los archivos con
+``format_version`` 1 (metadata como un único arreglo JSON) se siguen leyendo.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import struct
+import tempfile
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Sequence
+
+import numpy as np
+
+CURRENT_POINTER = "CURRENT"
+BUNDLE_FILENAME = "index.swidx"
+# Formato de instantánea anterior (tres archivos sueltos); solo lectura.
+EMBEDDINGS_FILENAME = "embeddings.npy"
+METADATA_FILENAME = "metadata.json"
+MANIFEST_FILENAME = "manifest.json"
+
+BUNDLE_MAGIC = b"SWIDX001"
+BUNDLE_ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct("<I")
+_SUPPORTED_DTYPES = {"float32": np.float32}
+_METADATA_OFFSET_DTYPE = np.dtype("<u8")
+BUNDLE_FORMAT_VERSION = 2
+
+
+class IndexMismatchError(ValueError):
+    """La instantánea fue construida con un modelo distinto al que la intenta cargar."""
+
+
+class IndexBundleError(ValueError):
+    """El archivo del índice está truncado, corrupto o tiene un formato desconocido."""
+
+
+def index_fingerprint(embeddings: np.ndarray, metadata_bytes: bytes | np.ndarray, chunk_rows: int = 65536) -> str:
+    digest = hashlib.sha256()
+    # Por bloques para no copiar en memoria una matriz mapeada completa.
+    for start in range(0, len(embeddings), chunk_rows):
+        digest.update(np.ascontiguousarray(embeddings[start : start + chunk_rows], dtype=np.float32).data)
+    digest.update(metadata_bytes)
+    return digest.hexdigest()
+
+
+def pack_metadata(metadata: list[dict[str, str]]) -> bytes:
+    """Empaqueta la metadata como tabla de desplazamientos seguida de un JSON por registro."""
+    records = [json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for item in metadata]
+    offsets = np.zeros(len(records) + 1, dtype=_METADATA_OFFSET_DTYPE)
+    np.cumsum([len(record) for record in records], out=offsets[1:])
+    return offsets.tobytes() + b"".join(records)
+
+
+class PackedMetadata(Sequence):
+    """Vista de solo lectura sobre la metadata empaquetada; decodifica cada registro al pedirlo."""
+
+    def __init__(self, block: bytes | np.ndarray, count: int) -> None:
+        block = np.frombuffer(block, dtype=np.uint8) if isinstance(block, bytes) else block
+        table_nbytes = (count + 1) * _METADATA_OFFSET_DTYPE.itemsize
+        if len(block) < table_nbytes:
+            raise IndexBundleError("Tabla de desplazamientos de metadata truncada")
+        self._offsets = block[:table_nbytes].view(_METADATA_OFFSET_DTYPE)
+        self._records = block[table_nbytes:]
+        if int(self._offsets[-1]) != len(self._records):
+            raise IndexBundleError("Tabla de desplazamientos de metadata inconsistente")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        try:
+            return json.loads(self._records[start:end].tobytes().decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise IndexBundleError(f"Registro de metadata {index} ilegible") from exc
+
+
+def _align(offset: int) -> int:
+    return (offset + BUNDLE_ALIGNMENT - 1) // BUNDLE_ALIGNMENT * BUNDLE_ALIGNMENT
+
+
+def write_bundle(
+    path: pathlib.Path,
+    embeddings: np.ndarray,
+    metadata: list[dict[str, str]],
+    header_fields: dict[str, Any],
+) -> dict[str, Any]:
+    """Escribe vectores, metadata y encabezado en un único archivo y devuelve el encabezado."""
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    metadata_bytes = pack_metadata(metadata)
+
+    header = dict(header_fields)
+    header.update(
+        {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "count": int(vectors.shape[0]),
+            "embedding_dim": int(vectors.shape[1]),
+            "dtype": "float32",
+            "vectors_nbytes": int(vectors.nbytes),
+            "metadata_nbytes": len(metadata_bytes),
+            "checksum_algorithm": "sha256",
+            "checksum": index_fingerprint(vectors, metadata_bytes),
+        }
+    )
+    header["fingerprint"] = header["checksum"]
+    # Los desplazamientos dependen del tamaño del propio encabezado: se serializa una
+    # vez con ceros y se reserva holgura para los dígitos de los valores definitivos.
+    header["vectors_offset"] = header["metadata_offset"] = 0
+    provisional = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    vectors_offset = _align(len(BUNDLE_MAGIC) + _HEADER_LENGTH.size + len(provisional) + 64)
+    header["vectors_offset"] = vectors_offset
+    header["metadata_offset"] = _align(vectors_offset + vectors.nbytes)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    if len(BUNDLE_MAGIC) + _HEADER_LENGTH.size + len(header_bytes) > vectors_offset:
+        raise IndexBundleError("El encabezado no cabe antes del bloque de vectores")
+
+    with path.open("wb") as fh:
+        fh.write(BUNDLE_MAGIC)
+        fh.write(_HEADER_LENGTH.pack(len(header_bytes)))
+        fh.write(header_bytes)
+        fh.write(b"\0" * (vectors_offset - fh.tell()))
+        fh.write(vectors.data)
+        fh.write(b"\0" * (header["metadata_offset"] - fh.tell()))
+        fh.write(metadata_bytes)
+        fh.flush()
+        os.fsync(fh.fileno())
+    return header
+
+
+def read_bundle_header(path: pathlib.Path) -> dict[str, Any]:
+    """Lee y valida el encabezado sin tocar los bloques de datos."""
+    file_size = path.stat().st_size
+    with path.open("rb") as fh:
+        if fh.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+            raise IndexBundleError(f"{path} no es un índice SWIDX001")
+        raw_length = fh.read(_HEADER_LENGTH.size)
+        if len(raw_length) != _HEADER_LENGTH.size:
+            raise IndexBundleError(f"{path}: encabezado truncado")
+        (header_length,) = _HEADER_LENGTH.unpack(raw_length)
+        try:
+            header = json.loads(fh.read(header_length).decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise IndexBundleError(f"{path}: encabezado ilegible") from exc
+
+    try:
+        dtype = np.dtype(_SUPPORTED_DTYPES[header["dtype"]])
+        count, dim = int(header["count"]), int(header["embedding_dim"])
+        vectors_offset, metadata_offset = int(header["vectors_offset"]), int(header["metadata_offset"])
+        vectors_nbytes, metadata_nbytes = int(header["vectors_nbytes"]), int(header["metadata_nbytes"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise IndexBundleError(f"{path}: encabezado incompleto o dtype no soportado") from exc
+
+    if vectors_nbytes != count * dim * dtype.itemsize:
+        raise IndexBundleError(f"{path}: tamaño del bloque de vectores inconsistente")
+    if vectors_offset % BUNDLE_ALIGNMENT or vectors_offset + vectors_nbytes > metadata_offset:
+        raise IndexBundleError(f"{path}: desplazamientos de bloques inválidos")
+    if metadata_offset + metadata_nbytes > file_size:
+        raise IndexBundleError(f"{path}: archivo truncado ({file_size} bytes)")
+    return header
+
+
+def read_bundle(
+    path: pathlib.Path, mmap: bool = True
+) -> tuple[dict[str, Any], np.ndarray, bytes | np.ndarray]:
+    """Devuelve encabezado, vectores y bloque de metadata (mapeados en disco con ``mmap``)."""
+    header = read_bundle_header(path)
+    shape = (int(header["count"]), int(header["embedding_dim"]))
+    dtype = _SUPPORTED_DTYPES[header["dtype"]]
+    if mmap and shape[0] > 0:
+        embeddings = np.memmap(path, dtype=dtype, mode="r", offset=int(header["vectors_offset"]), shape=shape)
+    else:
+        with path.open("rb") as fh:
+            fh.seek(int(header["vectors_offset"]))
+            embeddings = np.frombuffer(fh.read(int(header["vectors_nbytes"])), dtype=dtype).reshape(shape)
+    metadata_nbytes = int(header["metadata_nbytes"])
+    if mmap and metadata_nbytes > 0:
+        metadata_bytes = np.memmap(
+            path, dtype=np.uint8, mode="r", offset=int(header["metadata_offset"]), shape=(metadata_nbytes,)
+        )
+    else:
+        with path.open("rb") as fh:
+            fh.seek(int(header["metadata_offset"]))
+            metadata_bytes = fh.read(metadata_nbytes)
+    return header, embeddings, metadata_bytes
+
+
+def verify_bundle(header: dict[str, Any], embeddings: np.ndarray, metadata_bytes: bytes | np.ndarray) -> None:
+    """Recalcula el checksum completo; lanza ``IndexBundleError`` si no coincide."""
+    if index_fingerprint(embeddings, metadata_bytes) != header.get("checksum"):
+        raise IndexBundleError(f"Checksum inválido en el índice {header.get('version')}")
+
+
+def verify_in_background(
+    snapshot: "IndexSnapshot",
+    on_error: Callable[["IndexSnapshot", IndexBundleError], None],
+) -> threading.Thread:
+    """Verifica el checksum de ``snapshot`` en un hilo y llama ``on_error`` si falla."""
+
+    def _verify() -> None:
+        try:
+            verify_bundle(snapshot.manifest, snapshot.embeddings, snapshot.metadata_bytes)
+        except IndexBundleError as exc:
+            on_error(snapshot, exc)
+
+    thread = threading.Thread(target=_verify, name=f"index-verify-{snapshot.version}", daemon=True)
+    thread.start()
+    return thread
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    version: str
+    path: pathlib.Path | None
+    embeddings: np.ndarray
+    metadata: Sequence[dict[str, str]]
+    manifest: dict[str, Any]
+    metadata_bytes: bytes | np.ndarray = b""
+
+    @property
+    def verifiable(self) -> bool:
+        return "checksum" in self.manifest
+
+
+def _fsync_file(path: pathlib.Path) -> None:
+    with path.open("rb") as fh:
+        os.fsync(fh.fileno())
+
+
+def _fsync_dir(path: pathlib.Path) -> None:
+    if os.name == "nt":  # pragma: no cover - Windows no permite abrir carpetas
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class IndexStore:
+    """Gestiona las versiones publicadas del índice y el puntero ``CURRENT``."""
+
+    def __init__(self, root: str | pathlib.Path) -> None:
+        self.root = pathlib.Path(root)
+
+    @property
+    def pointer_path(self) -> pathlib.Path:
+        return self.root / CURRENT_POINTER
+
+    def current_version(self) -> str | None:
+        try:
+            version = self.pointer_path.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def list_versions(self) -> list[str]:
+        if not self.root.exists():
+            return []
+        return sorted(
+            p.name for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")
+        )
+
+    def publish(
+        self,
+        embeddings: np.ndarray,
+        metadata: list[dict[str, str]],
+        manifest: dict[str, Any],
+    ) -> str:
+        """Escribe una nueva instantánea inmutable y mueve ``CURRENT`` hacia ella."""
+        if embeddings.ndim != 2 or len(metadata) != len(embeddings):
+            raise ValueError("Dimensiones de embeddings/metadata incompatibles")
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        staging = pathlib.Path(tempfile.mkdtemp(prefix=".staging-", dir=self.root))
+        try:
+            header_fields = dict(manifest)
+            header_fields.update({"version": version, "created_at": datetime.now().isoformat()})
+            write_bundle(staging / BUNDLE_FILENAME, embeddings, metadata, header_fields)
+            _fsync_dir(staging)
+            os.replace(staging, self.root / version)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self._write_pointer(version)
+        return version
+
+    def _write_pointer(self, version: str) -> None:
+        fd, tmp_name = tempfile.mkstemp(prefix=".CURRENT-", dir=self.root)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(version)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_name, self.pointer_path)
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
+        _fsync_dir(self.root)
+
+    def load(self, version: str | None = None, mmap: bool = True) -> IndexSnapshot | None:
+        """Carga una instantánea (por defecto la apuntada por ``CURRENT``).
+
+        Cualquier archivo faltante o ilegible se reporta como ``IndexBundleError``.
+        """
+        version = version or self.current_version()
+        if version is None:
+            return None
+        try:
+            return self._read_snapshot(version, mmap)
+        except IndexBundleError:
+            raise
+        except (OSError, ValueError) as exc:
+            raise IndexBundleError(f"Instantánea {version} ilegible: {exc}") from exc
+
+    def _read_snapshot(self, version: str, mmap: bool) -> IndexSnapshot:
+        snapshot_dir = self.root / version
+        bundle_path = snapshot_dir / BUNDLE_FILENAME
+        if bundle_path.exists():
+            header, embeddings, metadata_bytes = read_bundle(bundle_path, mmap=mmap)
+            if int(header.get("format_version", 1)) >= 2:
+                metadata: Sequence[dict[str, str]] = PackedMetadata(metadata_bytes, len(embeddings))
+            else:
+                try:
+                    metadata = json.loads(bytes(metadata_bytes).decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+                    raise IndexBundleError(f"Instantánea {version}: metadata ilegible") from exc
+            if len(metadata) != len(embeddings):
+                raise IndexBundleError(f"Instantánea {version} corrupta: embeddings/metadata incompatibles")
+            return IndexSnapshot(
+                version=version,
+                path=snapshot_dir,
+                embeddings=embeddings,
+                metadata=metadata,
+                manifest=header,
+                metadata_bytes=metadata_bytes,
+            )
+
+        # Instantáneas publicadas antes del formato de un solo archivo.
+        if not (snapshot_dir / MANIFEST_FILENAME).exists():
+            raise IndexBundleError(f"Instantánea {version}: falta {bundle_path}")
+        with (snapshot_dir / MANIFEST_FILENAME).open("r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        embeddings = np.load(snapshot_dir / EMBEDDINGS_FILENAME, mmap_mode="r" if mmap else None)
+        with (snapshot_dir / METADATA_FILENAME).open("r", encoding="utf-8") as fh:
+            metadata = json.load(fh)
+
+        if embeddings.ndim != 2 or len(metadata) != len(embeddings):
+            raise IndexBundleError(f"Instantánea {version} corrupta: embeddings/metadata incompatibles")
+        return IndexSnapshot(
+            version=version,
+            path=snapshot_dir,
+            embeddings=embeddings,
+            metadata=metadata,
+            manifest=manifest,
+        )
+
+    def prune(self, keep: int) -> list[str]:
+        """Elimina versiones antiguas conservando las ``keep`` más recientes y la actual."""
+        if keep <= 0:
+            return []
+        current = self.current_version()
+        versions = self.list_versions()
+        removed: list[str] = []
+        for version in versions[:-keep]:
+            if version == current:
+                continue
+            shutil.rmtree(self.root / version, ignore_errors=True)
+            removed.append(version)
+        return removed
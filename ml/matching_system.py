@@ -3,14 +3,35 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 import pathlib
+import threading
 from dataclasses import dataclass
 from typing import Iterable, List, Sequence
 
 import numpy as np
 import tensorflow as tf
 
+from embedding_farm import EmbeddingFarm, FarmConfig, autotune, open_output_store
+from image_io import LOADER_NAME, TTA_VIEWS, load_image_batch, load_tta_views
+from index_store import (
+    IndexBundleError,
+    IndexMismatchError,
+    IndexSnapshot,
+    IndexStore,
+    verify_in_background,
+)
+from model_registry import (
+    MODEL_FILENAMES,
+    ModelRegistry,
+    find_model_file,
+    fingerprint_file,
+    load_keras_model,
+)
+
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+# A partir de este tamaño la granja escribe en un .npy mapeado en disco en lugar de en RAM.
+FARM_OUTPUT_STORE_MIN_ITEMS = 100_000
 
 
 @dataclass
@@ -29,6 +50,8 @@ class ShoeMatchingSystem:
         embedding_model_path: str | pathlib.Path,
         inventory_path: str | pathlib.Path = pathlib.Path("data") / "inventory",
         embeddings_output_path: str | pathlib.Path | None = None,
+        jit_compile: bool | None = None,
+        verify_checksum: bool = True,
     ) -> None:
         self.inventory_path = pathlib.Path(inventory_path)
         if not self.inventory_path.exists():
@@ -36,52 +59,80 @@ class ShoeMatchingSystem:
 
         embedding_model_path = pathlib.Path(embedding_model_path)
         if embedding_model_path.is_dir():
-            resolved = self._find_model_file_in_dir(embedding_model_path)
+            resolved = find_model_file(embedding_model_path)
+            print(f"Cargando modelo desde {resolved}")
         else:
             resolved = embedding_model_path
 
+        self.model_path = resolved
         self.export_dir = resolved.parent
         self.export_metadata = self._load_export_metadata(self.export_dir)
 
-        try:
-            self.embedding_model = tf.keras.models.load_model(resolved, safe_mode=False)
-        except TypeError:
-            # TensorFlow < 2.15 does not support safe_mode argument
-            self.embedding_model = tf.keras.models.load_model(resolved)
+        # Las capas deserializadas conservan la política de precisión guardada en el
+        # export; ``precision`` solo la registra. La compilación XLA sí se puede forzar.
+        self.precision = str(self.export_metadata.get("precision", "float32"))
+        self.jit_compile = (
+            bool(self.export_metadata.get("jit_compile", False)) if jit_compile is None else jit_compile
+        )
+
+        self.embedding_model = load_keras_model(resolved)
         if getattr(self.embedding_model, "output_shape", None) is None:
             raise ValueError("El modelo de embeddings no se cargó correctamente.")
 
         self.embedding_dim = int(self.embedding_model.output_shape[-1])
+        self.model_fingerprint = str(
+            self.export_metadata.get("model_fingerprint") or fingerprint_file(resolved)
+        )
+        self.registry = ModelRegistry(self.export_dir.parent)
+        self._compiled_infer = (
+            tf.function(lambda batch: self.embedding_model(batch, training=False), jit_compile=True)
+            if self.jit_compile
+            else None
+        )
 
+        # Rutas heredadas del formato anterior (dos archivos sobrescritos en sitio);
+        # solo se leen como migración si aún no existe ninguna instantánea versionada.
         default_embeddings_path = pathlib.Path("data") / "inventory_embeddings.npy"
         default_metadata_path = pathlib.Path("data") / "inventory_metadata.json"
         if embeddings_output_path is None:
             self.embeddings_path = default_embeddings_path
             self.metadata_path = default_metadata_path
+            index_root = pathlib.Path("data") / "index"
         else:
             base = pathlib.Path(embeddings_output_path)
             if base.suffix:
                 self.embeddings_path = base
                 self.metadata_path = base.with_suffix(".json")
+                index_root = base.parent / base.stem
             else:
                 self.embeddings_path = base / "inventory_embeddings.npy"
                 self.metadata_path = base / "inventory_metadata.json"
+                index_root = base / "index"
 
-        self.embedding_matrix: np.ndarray | None = None
-        self.metadata: list[dict[str, str]] = []
+        self.index_store = IndexStore(index_root)
+        self._snapshot: IndexSnapshot | None = None
+        self.verify_checksum = verify_checksum
+        self.index_error: Exception | None = None
+        self._rejected_versions: set[str] = set()
+        self._watch_stop: threading.Event | None = None
+        self._watch_thread: threading.Thread | None = None
 
         self._try_load_cached_embeddings()
 
-    @staticmethod
-    def _find_model_file_in_dir(directory: pathlib.Path) -> pathlib.Path:
-        for filename in ("embedding_model.keras", "embedding_model.h5"):
-            candidate = directory / filename
-            if candidate.exists():
-                print(f"Cargando modelo desde {candidate}")
-                return candidate
-        raise FileNotFoundError(
-            f"No se encontró un modelo en {directory}. Esperado embedding_model.keras u embedding_model.h5"
-        )
+    @property
+    def embedding_matrix(self) -> np.ndarray | None:
+        snapshot = self._snapshot
+        return snapshot.embeddings if snapshot is not None else None
+
+    @property
+    def metadata(self) -> Sequence[dict[str, str]]:
+        snapshot = self._snapshot
+        return snapshot.metadata if snapshot is not None else []
+
+    @property
+    def index_version(self) -> str | None:
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
 
     @staticmethod
     def _load_export_metadata(export_dir: pathlib.Path) -> dict[str, object]:
@@ -95,18 +146,137 @@ class ShoeMatchingSystem:
         return {}
 
     def _try_load_cached_embeddings(self) -> None:
-        if self.embeddings_path.exists() and self.metadata_path.exists():
+        try:
+            if self.refresh_index():
+                return
+        except IndexMismatchError as exc:
+            print(f"Índice rechazado: {exc}. Reconstrúyelo con este modelo (--overwrite).")
+            self.index_error = exc
+            return
+        except IndexBundleError as exc:
+            print(f"ERROR: índice corrupto, no se cargará: {exc}. Reconstrúyelo con --overwrite.")
+            self.index_error = exc
+            return
+        except Exception as exc:  # pragma: no cover
+            print(f"ERROR: no se pudo cargar la instantánea actual del índice: {exc}")
+            self.index_error = exc
+            return
+
+        if self._snapshot is None and self.embeddings_path.exists() and self.metadata_path.exists():
             try:
-                self.embedding_matrix = np.load(self.embeddings_path)
+                embedding_matrix = np.load(self.embeddings_path)
                 with self.metadata_path.open("r", encoding="utf-8") as fh:
-                    self.metadata = json.load(fh)
-                if self.embedding_matrix.ndim != 2 or len(self.metadata) != len(self.embedding_matrix):
+                    metadata = json.load(fh)
+                if embedding_matrix.ndim != 2 or len(metadata) != len(embedding_matrix):
                     raise ValueError("Dimensiones de embeddings/metadata incompatibles")
-                print(f"Cargado índice en memoria: {len(self.metadata)} productos")
+                if embedding_matrix.shape[1] != self.embedding_dim:
+                    raise IndexMismatchError(
+                        f"el índice heredado tiene dimensión {embedding_matrix.shape[1]},"
+                        f" el modelo produce {self.embedding_dim}"
+                    )
+                self._snapshot = IndexSnapshot(
+                    version="legacy",
+                    path=None,
+                    embeddings=embedding_matrix,
+                    metadata=metadata,
+                    manifest={},
+                )
+                print(f"Cargado índice en memoria: {len(metadata)} productos")
+            except IndexMismatchError as exc:
+                print(f"Índice rechazado: {exc}. Reconstrúyelo con este modelo (--overwrite).")
+                self.index_error = exc
             except Exception as exc:  # pragma: no cover
                 print("No se pudieron cargar embeddings cacheados:", exc)
-                self.embedding_matrix = None
-                self.metadata = []
+                self.index_error = exc
+
+    def _index_manifest(self) -> dict[str, object]:
+        return {
+            "model_export": self.export_dir.name,
+            "model_created_at": self.export_metadata.get("created_at"),
+            "model_metadata": self.export_metadata,
+            "model_fingerprint": self.model_fingerprint,
+            "normalized": True,
+            "image_loader": LOADER_NAME,
+        }
+
+    def refresh_index(self) -> bool:
+        """Swap in the snapshot referenced by the ``CURRENT`` pointer if it changed.
+
+        The new matrix is memory-mapped. When a snapshot is already being served
+        its pages are touched before the swap, so queries keep using the previous
+        snapshot until the new one is warm; the initial load only validates the
+        header. Returns ``True`` when a new snapshot was installed.
+        """
+        version = self.index_store.current_version()
+        if version is None or version == self.index_version or version in self._rejected_versions:
+            return False
+
+        try:
+            snapshot = self.index_store.load(version, mmap=True)
+        except IndexBundleError:
+            self._rejected_versions.add(version)
+            raise
+        if snapshot is None:
+            return False
+        if snapshot.embeddings.shape[1] != self.embedding_dim:
+            self._rejected_versions.add(version)
+            raise IndexMismatchError(
+                f"la instantánea {version} tiene dimensión {snapshot.embeddings.shape[1]},"
+                f" el modelo produce {self.embedding_dim}"
+            )
+        index_model = snapshot.manifest.get("model_fingerprint")
+        if index_model is not None and index_model != self.model_fingerprint:
+            self._rejected_versions.add(version)
+            raise IndexMismatchError(
+                f"la instantánea {version} se construyó con el export"
+                f" '{snapshot.manifest.get('model_export')}', no con '{self.export_dir.name}'"
+            )
+        previous = self._snapshot
+        if previous is not None:
+            # Fuerza la lectura de todas las páginas del mmap antes de reemplazar la instantánea.
+            float(np.add.reduce(snapshot.embeddings, axis=None))
+
+        self._snapshot = snapshot
+        self.index_error = None
+        print(f"Cargado índice {version} en memoria: {len(snapshot.metadata)} productos")
+
+        if self.verify_checksum and snapshot.verifiable:
+
+            def _on_corrupt(bad: IndexSnapshot, exc: IndexBundleError) -> None:
+                print(f"ERROR: {exc}. Se descarta la instantánea {bad.version}.")
+                self._rejected_versions.add(bad.version)
+                if self._snapshot is bad:
+                    self._snapshot = previous
+                    self.index_error = exc
+
+            verify_in_background(snapshot, _on_corrupt)
+        return True
+
+    def watch_index(self, interval: float = 2.0) -> None:
+        """Poll the ``CURRENT`` pointer in a background thread and hot-swap new snapshots."""
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+
+        stop = threading.Event()
+
+        def _watch() -> None:
+            while not stop.wait(interval):
+                try:
+                    self.refresh_index()
+                except Exception as exc:  # pragma: no cover
+                    print("No se pudo recargar el índice:", exc)
+
+        self._watch_stop = stop
+        self._watch_thread = threading.Thread(target=_watch, name="index-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self) -> None:
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+        self._watch_stop = None
+        self._watch_thread = None
 
     @staticmethod
     def _iter_image_paths(directory: pathlib.Path) -> Iterable[pathlib.Path]:
@@ -114,8 +284,38 @@ class ShoeMatchingSystem:
             if path.suffix.lower() in ALLOWED_EXTENSIONS:
                 yield path
 
-    def build_inventory_embeddings(self, batch_size: int = 32, overwrite: bool = False) -> int:
-        """Extract embeddings for all inventory images and optionally persist them."""
+    @staticmethod
+    def preprocess_images(paths: Sequence[pathlib.Path]) -> np.ndarray:
+        """Decode and resize images into a MobileNetV2-preprocessed float32 batch."""
+        batch = load_image_batch(paths, target_size=(224, 224))
+        return tf.keras.applications.mobilenet_v2.preprocess_input(batch)
+
+    def embed_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Run the embedding model on a preprocessed batch and L2-normalize the rows."""
+        if self._compiled_infer is not None:
+            embeddings = self._compiled_infer(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+        else:
+            embeddings = self.embedding_model.predict(batch, verbose=0)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8)
+
+    def build_inventory_embeddings(
+        self,
+        batch_size: int = 32,
+        overwrite: bool = False,
+        keep_versions: int = 3,
+        farm_config: FarmConfig | None = None,
+        register: bool = False,
+    ) -> int:
+        """Extract embeddings for all inventory images and publish them as a new snapshot.
+
+        With ``farm_config`` the images are split across worker processes (see
+        ``embedding_farm``) instead of running a single in-process predict loop.
+        Inventories of ``FARM_OUTPUT_STORE_MIN_ITEMS`` images or more are collected
+        in a memory-mapped scratch file next to the index instead of in RAM.
+        With ``register`` the snapshot is recorded in the model registry as the
+        index produced by this export; leave it off for throwaway builds.
+        """
         if self.embedding_matrix is not None and not overwrite:
             return len(self.metadata)
 
@@ -123,73 +323,90 @@ class ShoeMatchingSystem:
         if not image_paths:
             raise ValueError(f"No se encontraron imágenes en {self.inventory_path}")
 
-        all_embeddings: List[np.ndarray] = []
-        self.metadata = []
-
-        for start in range(0, len(image_paths), batch_size):
-            batch_paths = image_paths[start : start + batch_size]
-            batch_arrays = [
-                tf.keras.utils.img_to_array(
-                    tf.keras.utils.load_img(path, target_size=(224, 224))
-                )
-                for path in batch_paths
-            ]
-            batch = tf.convert_to_tensor(batch_arrays, dtype=tf.float32)
-            batch = tf.keras.applications.mobilenet_v2.preprocess_input(batch)
+        metadata = [{"name": path.stem, "path": str(path.resolve())} for path in image_paths]
 
-            embeddings = self.embedding_model.predict(batch, verbose=0)
-            embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8)
-            all_embeddings.append(embeddings)
-
-            for path, embedding in zip(batch_paths, embeddings):
-                self.metadata.append(
-                    {
-                        "name": path.stem,
-                        "path": str(path.resolve()),
-                    }
-                )
-
-        self.embedding_matrix = np.concatenate(all_embeddings, axis=0)
+        scratch_path: pathlib.Path | None = None
+        if farm_config is not None:
+            print(
+                f"Embebiendo con {farm_config.workers} procesos x {farm_config.intra_op_threads} hilos..."
+            )
+            out = None
+            if len(image_paths) >= FARM_OUTPUT_STORE_MIN_ITEMS:
+                scratch_path = self.index_store.root / f".farm-{os.getpid()}.npy"
+                out = open_output_store(scratch_path, len(image_paths), self.embedding_dim)
+            with EmbeddingFarm(self.model_path, farm_config, self.jit_compile, batch_size) as farm:
+                embedding_matrix = farm.embed(image_paths, chunk_size=batch_size, out=out)
+            del out
+        else:
+            all_embeddings: List[np.ndarray] = []
+            for start in range(0, len(image_paths), batch_size):
+                batch_paths = image_paths[start : start + batch_size]
+                all_embeddings.append(self.embed_batch(self.preprocess_images(batch_paths)))
+            embedding_matrix = np.concatenate(all_embeddings, axis=0)
 
-        self.embeddings_path.parent.mkdir(parents=True, exist_ok=True)
-        np.save(self.embeddings_path, self.embedding_matrix)
-        with self.metadata_path.open("w", encoding="utf-8") as fh:
-            json.dump(self.metadata, fh, ensure_ascii=False, indent=2)
+        try:
+            version = self.index_store.publish(embedding_matrix, metadata, self._index_manifest())
+        finally:
+            if scratch_path is not None:
+                # El memmap debe liberarse antes de borrar el archivo (Windows lo bloquea).
+                del embedding_matrix
+                scratch_path.unlink(missing_ok=True)
+        self.index_store.prune(keep_versions)
+        self.refresh_index()
+        if register:
+            self.registry.record_index(
+                self.export_dir, str(self._snapshot.manifest["fingerprint"]), self.index_store.root / version
+            )
 
-        print(f"Embeddings guardados en {self.embeddings_path} ({len(self.metadata)} items)")
-        return len(self.metadata)
+        print(f"Embeddings guardados en {self.index_store.root / version} ({len(metadata)} items)")
+        return len(metadata)
 
     @staticmethod
     def _cosine_similarity_matrix(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
         return matrix @ vector
 
-    def _ensure_embeddings(self) -> None:
-        if self.embedding_matrix is None:
+    def _ensure_embeddings(self) -> IndexSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
             raise ValueError(
                 "Embeddings no cargados. Ejecuta build_inventory_embeddings() primero o carga el índice cacheado."
-            )
+            ) from self.index_error
+        return snapshot
+
+    def embed_query(self, query_path: pathlib.Path, tta_views: int = 1) -> np.ndarray:
+        """Embed a query image, optionally fusing ``tta_views`` augmented views.
+
+        All views go through the model as a single batch; their embeddings are
+        averaged and renormalized so the index is still scanned only once.
+        """
+        if tta_views <= 1:
+            return self.embed_batch(self.preprocess_images([query_path]))[0]
+
+        views = load_tta_views(query_path, tta_views, target_size=(224, 224))
+        embeddings = self.embed_batch(tf.keras.applications.mobilenet_v2.preprocess_input(views))
+        fused = embeddings.mean(axis=0)
+        return fused / (np.linalg.norm(fused) + 1e-8)
 
-    def find_similar(self, query_image_path: str | pathlib.Path, top_k: int = 5) -> Sequence[MatchResult]:
+    def find_similar(
+        self,
+        query_image_path: str | pathlib.Path,
+        top_k: int = 5,
+        tta_views: int = 1,
+    ) -> Sequence[MatchResult]:
         """Return the most visually similar inventory items to the given query image."""
-        self._ensure_embeddings()
+        snapshot = self._ensure_embeddings()
         query_path = pathlib.Path(query_image_path)
         if not query_path.exists():
             raise FileNotFoundError(str(query_path))
 
-        img = tf.keras.utils.load_img(query_path, target_size=(224, 224))
-        img_array = tf.keras.utils.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = tf.keras.applications.mobilenet_v2.preprocess_input(img_array)
-
-        embedding = self.embedding_model.predict(img_array, verbose=0)[0]
-        embedding = embedding / (np.linalg.norm(embedding) + 1e-8)
+        embedding = self.embed_query(query_path, tta_views)
 
-        sims = self._cosine_similarity_matrix(self.embedding_matrix, embedding)
+        sims = self._cosine_similarity_matrix(snapshot.embeddings, embedding)
         top_indices = np.argsort(sims)[::-1][:top_k]
 
         results: List[MatchResult] = []
         for rank, idx in enumerate(top_indices, start=1):
-            meta = self.metadata[idx]
+            meta = snapshot.metadata[idx]
             results.append(
                 MatchResult(
                     rank=rank,
@@ -202,6 +419,18 @@ class ShoeMatchingSystem:
         return results
 
 
+def _workers_arg(value: str) -> int | str:
+    if value.lower() == "auto":
+        return "auto"
+    try:
+        workers = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"se esperaba un entero >= 0 o 'auto', no '{value}'") from None
+    if workers < 0:
+        raise argparse.ArgumentTypeError(f"se esperaba un entero >= 0 o 'auto', no '{value}'")
+    return workers
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Construye y consulta el índice de similitud de inventario")
     parser.add_argument(
@@ -222,19 +451,62 @@ if __name__ == "__main__":
         help="Imagen de consulta para buscar productos similares",
     )
     parser.add_argument("--top-k", type=int, default=5, help="Número de resultados similares a retornar")
+    parser.add_argument(
+        "--tta-views",
+        type=int,
+        default=1,
+        choices=range(1, len(TTA_VIEWS) + 1),
+        help="Vistas de la consulta (volteo, recortes centrales) fusionadas en un solo embedding",
+    )
     parser.add_argument(
         "--overwrite",
         action="store_true",
         help="Forzar recalcular embeddings incluso si existen en caché",
     )
+    parser.add_argument(
+        "--keep-versions",
+        type=int,
+        default=3,
+        help="Número de instantáneas del índice a conservar tras reconstruirlo",
+    )
+    parser.add_argument(
+        "--jit-compile",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Compilar la inferencia con XLA (por defecto lo registrado en el export)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=_workers_arg,
+        default=0,
+        help="Procesos de la granja de embeddings (0 = en proceso, 'auto' = autoajuste)",
+    )
+    parser.add_argument(
+        "--autotune-sample",
+        type=int,
+        default=256,
+        help="Imágenes distintas usadas por el autoajuste (se repiten hasta ocupar todos los procesos)",
+    )
     args = parser.parse_args()
 
     def resolve_model_path(value: str) -> pathlib.Path:
         def candidate_files(root: pathlib.Path) -> list[pathlib.Path]:
-            return [root / "embedding_model.keras", root / "embedding_model.h5"]
+            return [root / filename for filename in MODEL_FILENAMES]
 
         if value.lower() in {"auto", "latest"}:
             exports_root = pathlib.Path("exports")
+            registry = ModelRegistry(exports_root)
+            entry = registry.latest()
+            if entry is not None and registry.model_path(entry).exists():
+                candidate = registry.model_path(entry)
+                print(f"Usando modelo más reciente (registro): {candidate}")
+                return candidate
+
+            # Exports anteriores al registro: se recorre la carpeta como antes.
+            if not exports_root.exists():
+                parser.error(
+                    "No se encontró la carpeta 'exports/'. Ejecuta ml/train_mobilenet.py para generar un modelo."
+                )
             export_dirs = sorted(p for p in exports_root.iterdir() if p.is_dir())
             for directory in reversed(export_dirs):
                 for candidate in candidate_files(directory):
@@ -284,11 +556,26 @@ if __name__ == "__main__":
     model_path = resolve_model_path(args.model)
     inventory_path = resolve_inventory_path(args.inventory)
 
-    matcher = ShoeMatchingSystem(model_path, inventory_path)
-    count = matcher.build_inventory_embeddings(overwrite=args.overwrite)
+    matcher = ShoeMatchingSystem(
+        model_path, inventory_path, jit_compile=args.jit_compile
+    )
+
+    farm_config: FarmConfig | None = None
+    needs_build = matcher.embedding_matrix is None or args.overwrite
+    if needs_build and args.workers == "auto":
+        sample = list(matcher._iter_image_paths(inventory_path))[: args.autotune_sample]
+        print(f"Autoajustando la granja de embeddings con {len(sample)} imágenes...")
+        farm_config, _ = autotune(matcher.model_path, sample, jit_compile=matcher.jit_compile)
+        print(f"Configuración elegida: {farm_config}")
+    elif needs_build and args.workers > 0:
+        farm_config = FarmConfig.for_workers(args.workers)
+
+    count = matcher.build_inventory_embeddings(
+        overwrite=args.overwrite, keep_versions=args.keep_versions, farm_config=farm_config, register=True
+    )
     print(f"Embeddings disponibles para {count} imágenes")
 
     if args.query:
-        results = matcher.find_similar(args.query, top_k=args.top_k)
+        results = matcher.find_similar(args.query, top_k=args.top_k, tta_views=args.tta_views)
         for match in results:
             print(f"#{match.rank} {match.name} ({match.similarity * 100:.2f}%) -> {match.path}")
@@ -0,0 +1,200 @@
+"""Servidor PostgREST simulado para probar los scripts de subida sin tocar Supabase.
+
+Implementa lo mínimo que usan ``upload_embeddings_to_supabase.py`` y
+``async_uploader.py`` bajo ``/rest/v1/<tabla>``:
+
+- ``GET`` con filtros ``col=eq.valor`` / ``col=gt.valor``, ``order=col`` y ``limit``
+  (suficiente para la paginación por id de productos), recortado opcionalmente a
+  ``max_rows`` filas por respuesta como hace PostgREST con ``db-max-rows``,
+- ``POST`` de un objeto o un arreglo de objetos (inserción),
+
+con latencia y tasa de fallos (HTTP 503) configurables para ejercitar
+reintentos, concurrencia y el ajuste de lotes.
+
+Uso:
+python ml/mock_postgrest.py --port 54321 --products 5000 --latency_ms 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qsl, urlsplit
+
+REST_PREFIX = "/rest/v1/"
+
+
+@dataclass
+class MockState:
+    latency_ms: float = 0.0
+    failure_rate: float = 0.0
+    max_rows: int | None = None
+    tables: dict[str, list[dict[str, Any]]] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _coerce(value: str) -> Any:
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _select(
+    rows: list[dict[str, Any]],
+    params: list[tuple[str, str]],
+    max_rows: int | None = None,
+) -> list[dict[str, Any]]:
+    columns: list[str] | None = None
+    order: str | None = None
+    limit: int | None = None
+    for key, value in params:
+        if key == "select":
+            columns = None if value == "*" else [c.strip() for c in value.split(",")]
+        elif key == "order":
+            order = value.split(".")[0]
+        elif key == "limit":
+            limit = int(value)
+        elif "." in value:
+            op, operand = value.split(".", 1)
+            operand = _coerce(operand)
+            if op == "eq":
+                rows = [r for r in rows if r.get(key) == operand]
+            elif op == "gt":
+                rows = [r for r in rows if r.get(key) is not None and r[key] > operand]
+    if order:
+        rows = sorted(rows, key=lambda r: r.get(order))
+    if limit is not None:
+        rows = rows[:limit]
+    if max_rows is not None:
+        rows = rows[:max_rows]
+    if columns:
+        rows = [{c: r.get(c) for c in columns} for r in rows]
+    return rows
+
+
+def make_handler(state: MockState) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+            return
+
+        def _table(self) -> str | None:
+            path = urlsplit(self.path).path
+            if not path.startswith(REST_PREFIX):
+                return None
+            return path[len(REST_PREFIX) :].strip("/")
+
+        def _reply(self, status: int, payload: Any = None) -> None:
+            body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _simulate(self) -> bool:
+            if state.latency_ms:
+                time.sleep(state.latency_ms / 1000)
+            if state.failure_rate and random.random() < state.failure_rate:
+                self._reply(503, {"message": "fallo simulado"})
+                return False
+            return True
+
+        def do_GET(self) -> None:  # noqa: N802
+            table = self._table()
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            if table is None:
+                self._reply(404, {"message": "ruta desconocida"})
+                return
+            if not self._simulate():
+                return
+            with state.lock:
+                rows = list(state.tables.get(table, []))
+            self._reply(200, _select(rows, parse_qsl(urlsplit(self.path).query), state.max_rows))
+
+        def do_POST(self) -> None:  # noqa: N802
+            table = self._table()
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if table is None:
+                self._reply(404, {"message": "ruta desconocida"})
+                return
+            if not self._simulate():
+                return
+            try:
+                payload = json.loads(body or b"null")
+            except json.JSONDecodeError:
+                self._reply(400, {"message": "JSON inválido"})
+                return
+            rows = payload if isinstance(payload, list) else [payload]
+            with state.lock:
+                state.tables.setdefault(table, []).extend(rows)
+            if "return=representation" in (self.headers.get("Prefer") or ""):
+                self._reply(201, rows)
+            else:
+                self._reply(201)
+
+    return Handler
+
+
+class MockPostgrestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], state: MockState) -> None:
+        super().__init__(address, make_handler(state))
+        self.state = state
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency_ms: float = 0.0,
+    failure_rate: float = 0.0,
+    products: int = 0,
+    max_rows: int | None = None,
+) -> MockPostgrestServer:
+    """Arranca el servidor en un hilo de fondo; ``port=0`` elige un puerto libre."""
+    state = MockState(latency_ms=latency_ms, failure_rate=failure_rate, max_rows=max_rows)
+    state.tables["productos"] = [
+        {"id": i, "codigo": f"P{i:05d}", "estado": "activo"} for i in range(1, products + 1)
+    ]
+    server = MockPostgrestServer((host, port), state)
+    threading.Thread(target=server.serve_forever, name="mock-postgrest", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor PostgREST simulado para pruebas locales.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--products", type=int, default=100, help="Productos activos sembrados en 'productos'")
+    parser.add_argument("--latency_ms", type=float, default=0.0)
+    parser.add_argument("--failure_rate", type=float, default=0.0)
+    parser.add_argument("--max_rows", type=int, default=None, help="Filas máximas por respuesta (db-max-rows)")
+    args = parser.parse_args()
+
+    server = start_mock_server(
+        args.host, args.port, args.latency_ms, args.failure_rate, args.products, args.max_rows
+    )
+    print(f"PostgREST simulado escuchando en {server.base_url}{REST_PREFIX} (Ctrl+C para salir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
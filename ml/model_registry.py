@@ -0,0 +1,132 @@
+"""Registro en disco de los modelos exportados y de los índices construidos con ellos.
+
+``exports/registry.json`` guarda, por cada export, su carpeta, formato,
+``embedding_dim``, ``img_size``, la huella (sha256) del archivo del modelo y la
+huella del último índice construido con él. Resolver el export más reciente es
+una lectura de un solo archivo en lugar de listar y ordenar ``exports/``.
+
+``find_model_file`` y ``load_keras_model`` son el único punto donde se localiza y
+deserializa el modelo de un export (matcher, granja, subida y destilación).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+from datetime import datetime
+from typing import Any
+
+REGISTRY_FILENAME = "registry.json"
+DEFAULT_EXPORTS_ROOT = pathlib.Path("exports")
+MODEL_FILENAMES = ("embedding_model.keras", "embedding_model.h5")
+
+
+def fingerprint_file(path: str | pathlib.Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with pathlib.Path(path).open("rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_model_file(directory: str | pathlib.Path) -> pathlib.Path:
+    """Devuelve el archivo del modelo de embeddings dentro de la carpeta de un export."""
+    directory = pathlib.Path(directory)
+    for filename in MODEL_FILENAMES:
+        candidate = directory / filename
+        if candidate.exists():
+            return candidate
+    raise FileNotFoundError(
+        f"No se encontró un modelo en {directory}. Esperado {' u '.join(MODEL_FILENAMES)}"
+    )
+
+
+def load_keras_model(path: str | pathlib.Path):
+    """Carga un modelo Keras desde un archivo o desde la carpeta de un export."""
+    import tensorflow as tf
+
+    path = pathlib.Path(path)
+    if path.is_dir():
+        path = find_model_file(path)
+    if not path.exists():
+        raise FileNotFoundError(f"No se encontró el modelo en {path}")
+    try:
+        # safe_mode=False es necesario para modelos con capas Lambda como MobileNetV2
+        return tf.keras.models.load_model(path, safe_mode=False)
+    except TypeError:
+        # TensorFlow < 2.15 does not support safe_mode argument
+        return tf.keras.models.load_model(path)
+
+
+class ModelRegistry:
+    """Índice ``registry.json`` dentro de la carpeta raíz de exports."""
+
+    def __init__(self, exports_root: str | pathlib.Path = DEFAULT_EXPORTS_ROOT) -> None:
+        self.root = pathlib.Path(exports_root)
+        self.path = self.root / REGISTRY_FILENAME
+
+    def load(self) -> dict[str, Any]:
+        try:
+            with self.path.open("r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {"latest": None, "exports": {}}
+
+    def _save(self, registry: dict[str, Any]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=".registry-", dir=self.root)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(registry, fh, indent=2, ensure_ascii=False)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_name, self.path)
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def register_export(
+        self,
+        export_dir: pathlib.Path,
+        model_file: pathlib.Path,
+        metadata: dict[str, Any],
+        fingerprint: str,
+    ) -> dict[str, Any]:
+        """Añade o reemplaza la entrada del export y lo marca como el más reciente."""
+        registry = self.load()
+        entry = {
+            "path": export_dir.name,
+            "model_file": model_file.name,
+            "format": model_file.suffix.lstrip("."),
+            "embedding_dim": metadata.get("embedding_dim"),
+            "img_size": list(metadata.get("img_size", [])),
+            "model_fingerprint": fingerprint,
+            "created_at": metadata.get("created_at", datetime.now().isoformat()),
+            "index_fingerprint": None,
+        }
+        registry["exports"][export_dir.name] = entry
+        registry["latest"] = export_dir.name
+        self._save(registry)
+        return entry
+
+    def record_index(self, export_dir: pathlib.Path, index_fingerprint: str, index_path: pathlib.Path) -> None:
+        registry = self.load()
+        entry = registry["exports"].get(export_dir.name)
+        if entry is None:
+            return
+        entry["index_fingerprint"] = index_fingerprint
+        entry["index_path"] = str(index_path)
+        self._save(registry)
+
+    def get(self, name: str) -> dict[str, Any] | None:
+        return self.load()["exports"].get(name)
+
+    def latest(self) -> dict[str, Any] | None:
+        registry = self.load()
+        name = registry.get("latest")
+        return registry["exports"].get(name) if name else None
+
+    def model_path(self, entry: dict[str, Any]) -> pathlib.Path:
+        return self.root / entry["path"] / entry["model_file"]
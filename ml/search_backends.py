@@ -0,0 +1,150 @@
+"""Backends de búsqueda por similitud coseno sobre embeddings normalizados.
+
+- ``exact``: producto matricial completo en float32 (referencia).
+- ``int8``: cuantización escalar por fila a int8 (4x menos memoria).
+- ``ivf``: índice invertido sobre centroides k-means; solo se escanean las
+  ``nprobe`` listas más cercanas a la consulta (búsqueda aproximada).
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Devuelve (scores, índices) ordenados de mayor a menor para cada fila."""
+    top_k = min(top_k, scores.shape[1])
+    if top_k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(scores.dtype), empty.astype(np.int64)
+    if top_k < scores.shape[1]:
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(candidate_scores, order, axis=1),
+        np.take_along_axis(candidates, order, axis=1).astype(np.int64),
+    )
+
+
+class ExactBackend:
+    name = "exact"
+
+    def __init__(self, matrix: np.ndarray) -> None:
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes)
+
+    def search(self, queries: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        return _top_k(queries @ self.matrix.T, top_k)
+
+
+class Int8Backend:
+    name = "int8"
+
+    def __init__(self, matrix: np.ndarray) -> None:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        max_abs = np.abs(matrix).max(axis=1, keepdims=True)
+        self.scales = (np.maximum(max_abs, 1e-12) / 127.0).astype(np.float32)
+        self.codes = np.clip(np.rint(matrix / self.scales), -127, 127).astype(np.int8)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.scales.nbytes)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        chunk_size: int = 65536,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        scores = np.empty((queries.shape[0], self.codes.shape[0]), dtype=np.float32)
+        # Se descuantiza por bloques para no materializar la matriz completa en float32.
+        for start in range(0, self.codes.shape[0], chunk_size):
+            block = self.codes[start : start + chunk_size].astype(np.float32)
+            scores[:, start : start + chunk_size] = (
+                queries @ block.T
+            ) * self.scales[start : start + chunk_size, 0]
+        return _top_k(scores, top_k)
+
+
+class IVFBackend:
+    name = "ivf"
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        nlist: int | None = None,
+        nprobe: int = 8,
+        iterations: int = 10,
+        seed: int = 42,
+    ) -> None:
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        count = self.matrix.shape[0]
+        self.nlist = max(1, min(nlist or int(math.sqrt(count)), count))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+        self.centroids = self._train_centroids(iterations, seed)
+
+        assignments = np.argmax(self.matrix @ self.centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        self.list_ids = order.astype(np.int64)
+        self.list_offsets = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+
+    def _train_centroids(self, iterations: int, seed: int) -> np.ndarray:
+        """k-means esférico: los centroides se renormalizan en cada iteración."""
+        rng = np.random.default_rng(seed)
+        centroids = self.matrix[rng.choice(self.matrix.shape[0], self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(self.matrix @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, self.matrix)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = sums / norms
+        return centroids.astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes + self.centroids.nbytes + self.list_ids.nbytes)
+
+    def search(self, queries: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        _, probes = _top_k(queries @ self.centroids.T, self.nprobe)
+
+        all_scores = np.full((queries.shape[0], top_k), -np.inf, dtype=np.float32)
+        all_indices = np.full((queries.shape[0], top_k), -1, dtype=np.int64)
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate(
+                [self.list_ids[self.list_offsets[c] : self.list_offsets[c + 1]] for c in lists]
+            )
+            if candidates.size == 0:
+                continue
+            scores, positions = _top_k((self.matrix[candidates] @ query)[None, :], top_k)
+            found = positions.shape[1]
+            all_scores[row, :found] = scores[0]
+            all_indices[row, :found] = candidates[positions[0]]
+        return all_scores, all_indices
+
+
+BACKENDS = {
+    ExactBackend.name: ExactBackend,
+    Int8Backend.name: Int8Backend,
+    IVFBackend.name: IVFBackend,
+}
+
+
+def create_backend(name: str, matrix: np.ndarray, **options):
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError as exc:
+        raise ValueError(f"Backend de búsqueda desconocido: {name}. Opciones: {sorted(BACKENDS)}") from exc
+    return backend_cls(matrix, **options)
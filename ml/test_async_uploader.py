@@ -0,0 +1,70 @@
+"""Prueba de punta a punta del motor de subida asíncrono contra ``mock_postgrest.py``.
+
+python -m pytest ml/test_async_uploader.py
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from typing import Any, AsyncIterator
+
+import pytest
+
+from async_uploader import AsyncUploader, iterate_in_thread, synthetic_rows
+from mock_postgrest import start_mock_server
+
+
+def test_upload_with_simulated_failures_inserts_every_row_once() -> None:
+    rows = 600
+    server = start_mock_server(latency_ms=2, failure_rate=0.2)
+    try:
+        uploader = AsyncUploader(
+            server.base_url,
+            "test-key",
+            concurrency=8,
+            initial_batch_size=10,
+            max_batch_size=10,
+            max_retries=20,
+        )
+        # Lotes fijos de 10: unas 60 peticiones garantizan en la práctica algún 503 simulado.
+        summary = asyncio.run(uploader.upload(iterate_in_thread(synthetic_rows(rows, dim=8))))
+        stored = server.state.tables.get("producto_embeddings", [])
+    finally:
+        server.shutdown()
+
+    assert summary["retries"] > 0
+    assert summary["failed_rows"] == 0
+    assert summary["rows"] == rows
+    assert len(stored) == rows
+    duplicates = [name for name, count in Counter(row["fuente"] for row in stored).items() if count > 1]
+    assert not duplicates
+
+
+
+def test_source_error_cancels_in_flight_batches() -> None:
+    server = start_mock_server(latency_ms=200)
+
+    async def failing_rows() -> AsyncIterator[dict[str, Any]]:
+        for row in synthetic_rows(40, dim=8):
+            yield row
+        await asyncio.sleep(0.01)
+        raise RuntimeError("fallo en el pipeline de embeddings")
+
+    async def run() -> list[asyncio.Task]:
+        uploader = AsyncUploader(server.base_url, "test-key", concurrency=4, initial_batch_size=10, max_batch_size=10)
+        with pytest.raises(RuntimeError):
+            await uploader.upload(failing_rows())
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    try:
+        leftover = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert not leftover
+
+
+if __name__ == "__main__":
+    test_upload_with_simulated_failures_inserts_every_row_once()
+    test_source_error_cancels_in_flight_batches()
+    print("OK")
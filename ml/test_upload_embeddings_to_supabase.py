@@ -0,0 +1,44 @@
+"""Paginación por clave de productos contra ``mock_postgrest.py`` con límite ``max-rows``.
+
+python -m pytest ml/test_upload_embeddings_to_supabase.py
+"""
+from __future__ import annotations
+
+import importlib
+
+import httpx
+import pytest
+
+from mock_postgrest import REST_PREFIX, start_mock_server
+
+
+def test_mock_caps_responses_at_max_rows() -> None:
+    server = start_mock_server(products=50, max_rows=20)
+    try:
+        response = httpx.get(f"{server.base_url}{REST_PREFIX}productos", params={"order": "id", "limit": "100"})
+    finally:
+        server.shutdown()
+
+    assert response.status_code == 200
+    assert [row["id"] for row in response.json()] == list(range(1, 21))
+
+
+def test_keyset_pagination_reads_past_server_row_limit(monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("dotenv")
+    supabase = pytest.importorskip("supabase")
+
+    products = 2500
+    # Se piden páginas de 1000 pero el servidor corta cada respuesta en 300 filas.
+    server = start_mock_server(products=products, max_rows=300)
+    try:
+        monkeypatch.setenv("SUPABASE_URL", server.base_url)
+        monkeypatch.setenv("SUPABASE_KEY", "test.test.test")
+        uploader = importlib.import_module("upload_embeddings_to_supabase")
+        client = supabase.create_client(server.base_url, "test.test.test")
+        rows = list(uploader.iter_products_from_supabase(client, page_size=1000))
+    finally:
+        server.shutdown()
+
+    ids = [row["id"] for row in rows]
+    assert ids == list(range(1, products + 1))
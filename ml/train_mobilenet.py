@@ -2,6 +2,9 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import math
+import os
 import pathlib
 import sys
 from datetime import datetime
@@ -18,10 +21,17 @@ if not hasattr(np, "bool"):
 
 import tensorflow as tf
 
+from model_registry import ModelRegistry, fingerprint_file, load_keras_model
+
 AUTOTUNE = tf.data.AUTOTUNE
 DEFAULT_IMG_SIZE = (224, 224)
 DEFAULT_BATCH_SIZE = 32
 VALID_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+STUDENT_BACKBONES = ("mobilenet_v2_0.5", "mobilenet_v2_0.35", "mobilenet_v3_small")
+PRECISION_POLICIES = ("float32", "mixed_float16", "mixed_bfloat16")
+# tf.io.decode_image no soporta WebP, así que el pipeline balanceado lo omite.
+DECODABLE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+FILE_INDEX_DIRNAME = ".file_index"
 
 
 def build_datasets(
@@ -79,6 +89,155 @@ def build_datasets(
     return prepare(train_ds, True), prepare(val_ds, False), class_names, class_weights
 
 
+def _dirs_unchanged(recorded: dict[str, int]) -> bool:
+    try:
+        return all(os.stat(path).st_mtime_ns == mtime for path, mtime in recorded.items())
+    except FileNotFoundError:
+        return False
+
+
+def _scan_class_dir(class_dir: pathlib.Path, list_path: pathlib.Path) -> dict[str, object]:
+    """Recorre una clase una sola vez y escribe sus rutas, una por línea, en ``list_path``."""
+    dirs: dict[str, int] = {}
+    count = 0
+    tmp_path = list_path.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as fh:
+        for root, subdirs, files in os.walk(class_dir):
+            subdirs.sort()
+            dirs[root] = os.stat(root).st_mtime_ns
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in DECODABLE_EXTENSIONS:
+                    fh.write(os.path.join(root, name) + "\n")
+                    count += 1
+    os.replace(tmp_path, list_path)
+    return {"name": class_dir.name, "count": count, "list": list_path.name, "dirs": dirs}
+
+
+def scan_file_index(split_dir: pathlib.Path, cache_dir: pathlib.Path) -> list[dict[str, object]]:
+    """Índice de archivos por clase, cacheado en disco y reescaneado solo si cambió.
+
+    Cada clase se guarda como un archivo de texto con sus rutas; la validez se
+    comprueba con el mtime de las carpetas recorridas, sin volver a listarlas.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index_path = cache_dir / "index.json"
+    cached: dict[str, dict[str, object]] = {}
+    if index_path.exists():
+        try:
+            cached = {entry["name"]: entry for entry in json.loads(index_path.read_text(encoding="utf-8"))}
+        except (json.JSONDecodeError, KeyError, TypeError):
+            cached = {}
+
+    split_root = os.path.abspath(split_dir)
+    class_names = sorted(entry.name for entry in os.scandir(split_root) if entry.is_dir())
+    classes = []
+    rescanned = 0
+    for name in class_names:
+        entry = cached.get(name)
+        list_path = cache_dir / f"{hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]}.txt"
+        if entry is None or not list_path.exists() or not _dirs_unchanged(entry["dirs"]):
+            entry = _scan_class_dir(pathlib.Path(split_root) / name, list_path)
+            rescanned += 1
+        classes.append(entry)
+
+    index_path.write_text(json.dumps(classes, ensure_ascii=False), encoding="utf-8")
+    print(f"Índice de archivos de {split_dir}: {len(classes)} clases ({rescanned} reescaneadas)")
+    return classes
+
+
+def _labeled_lines(list_path: tf.Tensor, label: tf.Tensor) -> tf.data.Dataset:
+    return tf.data.TextLineDataset(list_path).map(lambda path: (path, label))
+
+
+def build_balanced_datasets(
+    data_root: pathlib.Path,
+    img_size: Tuple[int, int],
+    batch_size: int,
+    shuffle_buffer: int = 1000,
+    seed: int = 42,
+) -> tuple[tf.data.Dataset, tf.data.Dataset, list[str], int]:
+    """Pipeline alternativo balanceado por muestreo en lugar de pesos en la pérdida.
+
+    Cada clase es un flujo infinito que lee sus rutas desde el índice cacheado;
+    ``sample_from_datasets`` los intercala con probabilidad uniforme, así las
+    clases minoritarias se re-muestrean sin listar el árbol completo al inicio.
+    Devuelve también ``steps_per_epoch`` porque el flujo de entrenamiento no termina.
+    """
+    train_dir = data_root / "train"
+    val_dir = data_root / "val"
+
+    if not train_dir.exists():
+        raise FileNotFoundError(f"No se encontró el directorio de entrenamiento: {train_dir}")
+    if not val_dir.exists():
+        raise FileNotFoundError(f"No se encontró el directorio de validación: {val_dir}")
+
+    cache_root = data_root / FILE_INDEX_DIRNAME
+    train_classes = scan_file_index(train_dir, cache_root / "train")
+    class_names = [str(entry["name"]) for entry in train_classes]
+    print(f"Clases detectadas ({len(class_names)}): {class_names}")
+    num_classes = len(class_names)
+
+    def decode(path: tf.Tensor, label: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, img_size)
+        return image, tf.one_hot(label, num_classes)
+
+    streams = [
+        _labeled_lines(str(cache_root / "train" / str(entry["list"])), tf.constant(idx, tf.int64))
+        .shuffle(shuffle_buffer, seed=seed + idx, reshuffle_each_iteration=True)
+        .repeat()
+        for idx, entry in enumerate(train_classes)
+        if int(entry["count"]) > 0
+    ]
+    if not streams:
+        raise ValueError(f"No se encontraron imágenes en {train_dir}")
+    train_ds = (
+        tf.data.Dataset.sample_from_datasets(streams, weights=[1.0 / len(streams)] * len(streams), seed=seed)
+        .map(decode, num_parallel_calls=AUTOTUNE)
+        .batch(batch_size)
+        .prefetch(AUTOTUNE)
+    )
+    total = sum(int(entry["count"]) for entry in train_classes)
+    steps_per_epoch = max(1, math.ceil(total / batch_size))
+
+    label_by_name = {name: idx for idx, name in enumerate(class_names)}
+    val_entries = [
+        entry
+        for entry in scan_file_index(val_dir, cache_root / "val")
+        if entry["name"] in label_by_name and int(entry["count"]) > 0
+    ]
+    val_lists = [str(cache_root / "val" / str(entry["list"])) for entry in val_entries]
+    val_labels = [label_by_name[str(entry["name"])] for entry in val_entries]
+    val_ds = (
+        tf.data.Dataset.from_tensor_slices((val_lists, tf.constant(val_labels, tf.int64)))
+        .interleave(_labeled_lines, cycle_length=max(1, len(val_lists)), deterministic=True)
+        .map(decode, num_parallel_calls=AUTOTUNE)
+        .batch(batch_size)
+        .cache()
+        .prefetch(AUTOTUNE)
+    )
+    return train_ds, val_ds, class_names, steps_per_epoch
+
+
+def build_augmentation() -> tf.keras.Sequential:
+    return tf.keras.Sequential(
+        [
+            tf.keras.layers.RandomFlip("horizontal"),
+            tf.keras.layers.RandomRotation(0.05),
+            tf.keras.layers.RandomZoom(0.15),
+            tf.keras.layers.RandomContrast(0.1),
+            tf.keras.layers.RandomTranslation(0.08, 0.08),
+        ],
+        name="augmentation",
+    )
+
+
+def normalize_embedding(projection: tf.Tensor) -> tf.Tensor:
+    # Con políticas mixtas la normalización se calcula en float32 para que los embeddings
+    # exportados conserven la precisión esperada por la similitud coseno.
+    return tf.keras.layers.UnitNormalization(axis=1, name="embedding_norm", dtype="float32")(projection)
+
+
 def build_model(
     num_classes: int,
     img_size: Tuple[int, int],
@@ -95,16 +254,7 @@ def build_model(
     )
     base_model.trainable = False
 
-    data_augmentation = tf.keras.Sequential(
-        [
-            tf.keras.layers.RandomFlip("horizontal"),
-            tf.keras.layers.RandomRotation(0.05),
-            tf.keras.layers.RandomZoom(0.15),
-            tf.keras.layers.RandomContrast(0.1),
-            tf.keras.layers.RandomTranslation(0.08, 0.08),
-        ],
-        name="augmentation",
-    )
+    data_augmentation = build_augmentation()
 
     inputs = tf.keras.Input(shape=img_size + (3,), name="image")
     x = data_augmentation(inputs)
@@ -117,12 +267,13 @@ def build_model(
         kernel_regularizer=tf.keras.regularizers.l2(projection_regularizer),
         name="embedding",
     )(x)
-    normalized = tf.keras.layers.UnitNormalization(axis=1, name="embedding_norm")(projection)
+    normalized = normalize_embedding(projection)
     logits = tf.keras.layers.Dense(
         num_classes,
         activation="softmax",
         kernel_regularizer=tf.keras.regularizers.l2(projection_regularizer),
         name="classifier",
+        dtype="float32",
     )(normalized)
 
     training_model = tf.keras.Model(inputs, logits, name="stockwear_mobilenet_v2")
@@ -130,6 +281,152 @@ def build_model(
     return training_model, embedding_model
 
 
+def build_student_model(
+    backbone: str,
+    img_size: Tuple[int, int],
+    dropout: float,
+    embedding_dim: int,
+    projection_regularizer: float,
+) -> tf.keras.Model:
+    """Modelo de embeddings compacto con la misma interfaz de entrada/salida que el profesor."""
+    input_shape = img_size + (3,)
+    if backbone.startswith("mobilenet_v2_"):
+        base_model = tf.keras.applications.MobileNetV2(
+            include_top=False,
+            weights="imagenet",
+            input_shape=input_shape,
+            alpha=float(backbone.rsplit("_", 1)[1]),
+            pooling="avg",
+        )
+    elif backbone == "mobilenet_v3_small":
+        # Sin preprocesamiento interno: se usa el mismo escalado [-1, 1] que MobileNetV2.
+        base_model = tf.keras.applications.MobileNetV3Small(
+            include_top=False,
+            weights="imagenet",
+            input_shape=input_shape,
+            pooling="avg",
+            include_preprocessing=False,
+        )
+    else:
+        raise ValueError(f"Backbone de estudiante desconocido: {backbone}. Opciones: {STUDENT_BACKBONES}")
+
+    inputs = tf.keras.Input(shape=input_shape, name="image")
+    x = tf.keras.applications.mobilenet_v2.preprocess_input(inputs)
+    x = base_model(x)
+    x = tf.keras.layers.Dropout(dropout)(x)
+    projection = tf.keras.layers.Dense(
+        embedding_dim,
+        activation=None,
+        kernel_regularizer=tf.keras.regularizers.l2(projection_regularizer),
+        name="embedding",
+    )(x)
+    normalized = normalize_embedding(projection)
+    return tf.keras.Model(inputs, normalized, name=f"stockwear_{backbone.replace('.', '_')}_embeddings")
+
+
+class EmbeddingDistiller(tf.keras.Model):
+    """Entrena un estudiante para reproducir los embeddings normalizados del profesor."""
+
+    def __init__(
+        self,
+        student: tf.keras.Model,
+        teacher: tf.keras.Model,
+        augmentation: tf.keras.Model,
+        cosine_weight: float,
+        mse_weight: float,
+    ) -> None:
+        super().__init__(name="embedding_distiller")
+        self.student = student
+        self.teacher = teacher
+        self.teacher.trainable = False
+        self.augmentation = augmentation
+        self.cosine_weight = cosine_weight
+        self.mse_weight = mse_weight
+        self.loss_tracker = tf.keras.metrics.Mean(name="loss")
+        self.cosine_tracker = tf.keras.metrics.Mean(name="cosine")
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.cosine_tracker]
+
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+
+    def _distillation_loss(self, targets: tf.Tensor, predictions: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+        # El profesor puede no terminar en UnitNormalization (p. ej. MobileNetV2 alpha 1.4 sin cabeza).
+        targets = tf.math.l2_normalize(tf.cast(targets, tf.float32), axis=1)
+        predictions = tf.cast(predictions, tf.float32)
+        cosine = tf.reduce_mean(tf.reduce_sum(targets * predictions, axis=1))
+        mse = tf.reduce_mean(tf.reduce_sum(tf.square(targets - predictions), axis=1))
+        return self.cosine_weight * (1.0 - cosine) + self.mse_weight * mse, cosine
+
+    def _scale_loss(self, loss: tf.Tensor) -> tf.Tensor:
+        # Con mixed_float16 el optimizador se envuelve en LossScaleOptimizer y la pérdida
+        # debe escalarse manualmente en un train_step propio (API de Keras 2 y Keras 3).
+        if hasattr(self.optimizer, "get_scaled_loss"):
+            return self.optimizer.get_scaled_loss(loss)
+        if hasattr(self.optimizer, "scale_loss"):
+            return self.optimizer.scale_loss(loss)
+        return loss
+
+    def train_step(self, data):
+        images = data[0] if isinstance(data, tuple) else data
+        images = self.augmentation(images, training=True)
+        targets = self.teacher(images, training=False)
+        with tf.GradientTape() as tape:
+            predictions = self.student(images, training=True)
+            loss, cosine = self._distillation_loss(targets, predictions)
+            if self.student.losses:
+                loss += tf.add_n(self.student.losses)
+            scaled_loss = self._scale_loss(loss)
+        gradients = tape.gradient(scaled_loss, self.student.trainable_variables)
+        if hasattr(self.optimizer, "get_unscaled_gradients"):
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+        self.optimizer.apply_gradients(zip(gradients, self.student.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        self.cosine_tracker.update_state(cosine)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        images = data[0] if isinstance(data, tuple) else data
+        targets = self.teacher(images, training=False)
+        predictions = self.student(images, training=False)
+        loss, cosine = self._distillation_loss(targets, predictions)
+        self.loss_tracker.update_state(loss)
+        self.cosine_tracker.update_state(cosine)
+        return {m.name: m.result() for m in self.metrics}
+
+
+def load_teacher_model(path: pathlib.Path) -> tf.keras.Model:
+    """Carga el modelo de embeddings de un export (carpeta o archivo)."""
+    print(f"Cargando modelo profesor desde {path}...")
+    return load_keras_model(path)
+
+
+def distill(
+    distiller: EmbeddingDistiller,
+    train_ds: tf.data.Dataset,
+    val_ds: tf.data.Dataset,
+    epochs: int,
+    callbacks: list[tf.keras.callbacks.Callback],
+    weight_decay: float,
+    jit_compile: bool = False,
+    steps_per_epoch: int | None = None,
+):
+    """Entrena el estudiante contra los embeddings del profesor (sin etiquetas)."""
+    optimizer = tf.keras.optimizers.AdamW(learning_rate=1e-3, weight_decay=weight_decay)
+    if tf.keras.mixed_precision.global_policy().name == "mixed_float16":
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    distiller.compile(optimizer=optimizer, jit_compile=jit_compile)
+    return distiller.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=epochs,
+        callbacks=callbacks,
+        steps_per_epoch=steps_per_epoch,
+    )
+
+
 def train(
     model: tf.keras.Model,
     train_ds: tf.data.Dataset,
@@ -139,17 +436,25 @@ def train(
     callbacks: list[tf.keras.callbacks.Callback],
     label_smoothing: float,
     weight_decay: float,
+    jit_compile: bool = False,
+    steps_per_epoch: int | None = None,
 ):
     """Realiza el entrenamiento con capas base congeladas."""
     loss = tf.keras.losses.CategoricalCrossentropy(label_smoothing=label_smoothing)
     optimizer = tf.keras.optimizers.AdamW(learning_rate=1e-3, weight_decay=weight_decay)
-    model.compile(optimizer=optimizer, loss=loss, metrics=["accuracy", "top_k_categorical_accuracy"])
+    model.compile(
+        optimizer=optimizer,
+        loss=loss,
+        metrics=["accuracy", "top_k_categorical_accuracy"],
+        jit_compile=jit_compile,
+    )
     history = model.fit(
         train_ds,
         validation_data=val_ds,
         epochs=epochs,
         callbacks=callbacks,
         class_weight=class_weights,
+        steps_per_epoch=steps_per_epoch,
     )
     return history
 
@@ -164,6 +469,8 @@ def fine_tune(
     callbacks: list[tf.keras.callbacks.Callback],
     label_smoothing: float,
     weight_decay: float,
+    jit_compile: bool = False,
+    steps_per_epoch: int | None = None,
 ):
     """Descongela las últimas capas de MobileNet para afinar pesos."""
     if epochs <= 0:
@@ -186,13 +493,19 @@ def fine_tune(
 
     loss = tf.keras.losses.CategoricalCrossentropy(label_smoothing=label_smoothing)
     optimizer = tf.keras.optimizers.AdamW(learning_rate=5e-5, weight_decay=weight_decay / 2)
-    model.compile(optimizer=optimizer, loss=loss, metrics=["accuracy", "top_k_categorical_accuracy"])
+    model.compile(
+        optimizer=optimizer,
+        loss=loss,
+        metrics=["accuracy", "top_k_categorical_accuracy"],
+        jit_compile=jit_compile,
+    )
     history = model.fit(
         train_ds,
         validation_data=val_ds,
         epochs=epochs,
         callbacks=callbacks,
         class_weight=class_weights,
+        steps_per_epoch=steps_per_epoch,
     )
     return history
 
@@ -232,9 +545,17 @@ def export_model(
     metadata_to_save = dict(metadata)
     if saved_path is not None:
         metadata_to_save["model_file"] = saved_path.name
+        metadata_to_save["model_fingerprint"] = fingerprint_file(saved_path)
     metadata_path.write_text(json.dumps(metadata_to_save, indent=2, ensure_ascii=False), encoding="utf-8")
     print(f"Metadatos guardados en {metadata_path}")
 
+    if saved_path is not None:
+        registry = ModelRegistry(export_root.parent)
+        registry.register_export(
+            export_root, saved_path, metadata_to_save, metadata_to_save["model_fingerprint"]
+        )
+        print(f"Export registrado en {registry.path}")
+
     try:
         import tensorflowjs as tfjs  # type: ignore
         try:
@@ -252,6 +573,84 @@ def export_model(
         print("El SavedModel fue guardado. Ejecuta el conversor manualmente si es necesario.")
 
 
+def build_callbacks(args: argparse.Namespace) -> list[tf.keras.callbacks.Callback]:
+    return [
+        tf.keras.callbacks.ReduceLROnPlateau(
+            monitor="val_loss",
+            factor=0.3,
+            patience=args.reduce_lr_patience,
+            min_lr=1e-6,
+            verbose=1,
+        ),
+        tf.keras.callbacks.EarlyStopping(
+            monitor="val_loss",
+            patience=args.early_stopping_patience,
+            restore_best_weights=True,
+            verbose=1,
+        ),
+    ]
+
+
+def run_distillation(
+    args: argparse.Namespace,
+    img_size: Tuple[int, int],
+    train_ds: tf.data.Dataset,
+    val_ds: tf.data.Dataset,
+    class_names: list[str],
+    steps_per_epoch: int | None = None,
+) -> None:
+    """Destila el profesor en un backbone compacto y lo exporta con los mismos metadatos."""
+    teacher = load_teacher_model(args.distill_teacher)
+    embedding_dim = int(teacher.output_shape[-1])
+    student = build_student_model(
+        args.student_backbone,
+        img_size,
+        args.dropout,
+        embedding_dim,
+        args.projection_regularizer,
+    )
+    print(
+        f"Destilando {teacher.name} ({teacher.count_params():,} parámetros) en"
+        f" {student.name} ({student.count_params():,} parámetros)..."
+    )
+
+    distiller = EmbeddingDistiller(
+        student,
+        teacher,
+        build_augmentation(),
+        args.distill_cosine_weight,
+        args.distill_mse_weight,
+    )
+    distill(
+        distiller,
+        train_ds,
+        val_ds,
+        args.epochs,
+        build_callbacks(args),
+        args.weight_decay,
+        args.jit_compile,
+        steps_per_epoch,
+    )
+
+    metadata = {
+        "created_at": datetime.now().isoformat(),
+        "classes": class_names,
+        "img_size": img_size,
+        "embedding_dim": embedding_dim,
+        "dropout": args.dropout,
+        "projection_regularizer": args.projection_regularizer,
+        "backbone": args.student_backbone,
+        "distilled_from": str(args.distill_teacher),
+        "distill_cosine_weight": args.distill_cosine_weight,
+        "distill_mse_weight": args.distill_mse_weight,
+        "teacher_params": teacher.count_params(),
+        "student_params": student.count_params(),
+        "precision": args.precision,
+        "jit_compile": args.jit_compile,
+    }
+    export_model(student, args.export, metadata, args.metadata_filename)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Entrena MobileNetV2 con imágenes personalizadas.")
     parser.add_argument("--data", type=pathlib.Path, default=pathlib.Path("data"), help="Raíz del dataset con train/ y val/")
@@ -268,6 +667,27 @@ def main():
     parser.add_argument("--embedding_dim", type=int, default=256)
     parser.add_argument("--projection_regularizer", type=float, default=1e-4)
     parser.add_argument("--metadata_filename", type=str, default="metadata.json")
+    parser.add_argument(
+        "--distill_teacher",
+        type=pathlib.Path,
+        default=None,
+        help="Export (carpeta o archivo) del modelo profesor; activa el modo de destilación",
+    )
+    parser.add_argument("--student_backbone", choices=STUDENT_BACKBONES, default="mobilenet_v2_0.5")
+    parser.add_argument("--distill_cosine_weight", type=float, default=1.0)
+    parser.add_argument("--distill_mse_weight", type=float, default=0.0)
+    parser.add_argument(
+        "--precision",
+        choices=PRECISION_POLICIES,
+        default="float32",
+        help="Política de precisión de Keras (la salida normalizada se mantiene en float32)",
+    )
+    parser.add_argument("--jit_compile", action="store_true", help="Compila entrenamiento e inferencia con XLA")
+    parser.add_argument(
+        "--balanced_sampling",
+        action="store_true",
+        help="Balancea clases re-muestreando flujos por clase (índice de archivos cacheado) en lugar de class_weights",
+    )
     parser.add_argument(
         "--export",
         type=pathlib.Path,
@@ -277,7 +697,15 @@ def main():
     args = parser.parse_args()
 
     img_size = tuple(args.img_size)
-    train_ds, val_ds, class_names, class_weights = build_datasets(args.data, img_size, args.batch_size)
+    tf.keras.mixed_precision.set_global_policy(args.precision)
+    steps_per_epoch: int | None = None
+    if args.balanced_sampling:
+        train_ds, val_ds, class_names, steps_per_epoch = build_balanced_datasets(
+            args.data, img_size, args.batch_size
+        )
+        class_weights = None
+    else:
+        train_ds, val_ds, class_names, class_weights = build_datasets(args.data, img_size, args.batch_size)
     if len(class_names) <= 1:
         print(
             "Se requiere al menos 2 clases para entrenar un modelo de similitud visual."
@@ -286,6 +714,11 @@ def main():
         sys.exit(1)
     if class_weights is None:
         class_weights = None
+
+    if args.distill_teacher is not None:
+        run_distillation(args, img_size, train_ds, val_ds, class_names, steps_per_epoch)
+        return
+
     training_model, embedding_model = build_model(
         len(class_names),
         img_size,
@@ -294,21 +727,7 @@ def main():
         args.projection_regularizer,
     )
 
-    callbacks = [
-        tf.keras.callbacks.ReduceLROnPlateau(
-            monitor="val_loss",
-            factor=0.3,
-            patience=args.reduce_lr_patience,
-            min_lr=1e-6,
-            verbose=1,
-        ),
-        tf.keras.callbacks.EarlyStopping(
-            monitor="val_loss",
-            patience=args.early_stopping_patience,
-            restore_best_weights=True,
-            verbose=1,
-        ),
-    ]
+    callbacks = build_callbacks(args)
 
     print("Entrenamiento inicial...")
     train(
@@ -320,6 +739,8 @@ def main():
         callbacks,
         args.label_smoothing,
         args.weight_decay,
+        args.jit_compile,
+        steps_per_epoch,
     )
 
     print("Fine-tuning de capas superiores...")
@@ -333,6 +754,8 @@ def main():
         callbacks,
         args.label_smoothing,
         args.weight_decay,
+        args.jit_compile,
+        steps_per_epoch,
     )
 
     metadata = {
@@ -342,8 +765,13 @@ def main():
         "embedding_dim": args.embedding_dim,
         "dropout": args.dropout,
         "projection_regularizer": args.projection_regularizer,
+        "backbone": "mobilenet_v2_1.0",
+        "precision": args.precision,
+        "jit_compile": args.jit_compile,
+        "balanced_sampling": args.balanced_sampling,
     }
     export_model(embedding_model, args.export, metadata, args.metadata_filename)
 
+
 if __name__ == "__main__":
     main()
@@ -4,16 +4,19 @@ Sube embeddings de imágenes de productos a una base de datos Supabase.
 Este script realiza los siguientes pasos:
 1.  Se conecta a Supabase usando las credenciales del entorno.
 2.  Carga un modelo de embeddings de Keras (MobileNetV2 por defecto).
-3.  Obtiene la lista de productos de la tabla 'productos' en Supabase.
-4.  Para cada producto, busca imágenes correspondientes en una carpeta local.
+3.  Recorre una sola vez la carpeta local de imágenes y construye el mapa código -> archivos.
     Se espera que las imágenes estén organizadas en subcarpetas nombradas con el 'código' del producto.
     Ejemplo: /data/inventory/CODIGO_PRODUCTO_1/imagen1.jpg
-5.  Genera un embedding para cada imagen encontrada.
-6.  Sube el embedding a la tabla 'producto_embeddings', asociándolo con el ID del producto.
+4.  Obtiene los productos activos de la tabla 'productos' en páginas (paginación por id).
+5.  Genera los embeddings de las imágenes de cada producto por lotes.
+6.  Sube cada embedding a la tabla 'producto_embeddings', asociándolo con el ID del producto.
+
+Los pasos 4-6 se ejecutan como etapas encadenadas con colas acotadas, por lo que la
+memoria se mantiene estable sin importar el tamaño del catálogo.
 
 Requisitos:
 - Python 3.9+
-- pip install supabase python-dotenv tensorflow numpy
+- pip install supabase python-dotenv tensorflow numpy pillow httpx (h2 opcional para HTTP/2)
 - Un archivo .env en la raíz del proyecto con:
   SUPABASE_URL="tu_url_de_supabase"
   SUPABASE_KEY="tu_llave_de_servicio_de_supabase"
@@ -24,15 +27,22 @@ python ml/upload_embeddings_to_supabase.py --images_dir data/inventory --model_p
 from __future__ import annotations
 
 import argparse
+import asyncio
 import os
 import pathlib
-from typing import Any, Sequence
+import queue
+import threading
+from typing import Any, Iterable, Iterator, Sequence, TypeVar
 
 import numpy as np
 import tensorflow as tf
 from dotenv import load_dotenv
 from supabase import Client, create_client
 
+from async_uploader import AsyncUploader, iterate_in_thread
+from image_io import load_image_array
+from model_registry import load_keras_model
+
 # --- Configuración ---
 # Carga las variables de entorno desde el archivo .env
 
@@ -47,6 +57,10 @@ if not SUPABASE_URL or not SUPABASE_KEY:
         "Crea un archivo .env en la raíz del proyecto y añade las credenciales."
     )
 
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+T = TypeVar("T")
+
 # --- Funciones de Ayuda ---
 
 def get_supabase_client() -> Client:
@@ -57,42 +71,153 @@ def get_supabase_client() -> Client:
 def load_embedding_model(model_path: str | pathlib.Path) -> tf.keras.Model:
     """Carga el modelo de Keras para generar embeddings."""
     print(f"Cargando modelo desde: {model_path}")
-    try:
-        # safe_mode=False es necesario para modelos con capas Lambda como MobileNetV2
-        model = tf.keras.models.load_model(model_path, safe_mode=False)
-    except TypeError:
-        # Versiones más antiguas de TensorFlow no tienen el argumento safe_mode
-        model = tf.keras.models.load_model(model_path)
+    model = load_keras_model(model_path)
     print("Modelo cargado exitosamente.")
     return model
 
 
-def generate_embedding(model: tf.keras.Model, image_path: pathlib.Path) -> np.ndarray:
-    """Genera un embedding para una única imagen."""
-    try:
-        img = tf.keras.utils.load_img(image_path, target_size=(224, 224))
-        img_array = tf.keras.utils.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = tf.keras.applications.mobilenet_v2.preprocess_input(img_array)
+def generate_embeddings(
+    model: tf.keras.Model,
+    image_paths: Sequence[pathlib.Path],
+) -> list[np.ndarray]:
+    """Genera embeddings normalizados para un lote de imágenes.
+
+    Devuelve un embedding por ruta, en el mismo orden; las imágenes ilegibles (o el
+    lote completo si falla la inferencia) quedan como arreglos vacíos.
+    """
+    results = [np.array([]) for _ in image_paths]
+    loaded: list[tuple[int, np.ndarray]] = []
+    for position, image_path in enumerate(image_paths):
+        try:
+            loaded.append((position, load_image_array(image_path)))
+        except Exception as e:
+            print(f"Error procesando la imagen {image_path}: {e}")
+    if not loaded:
+        return results
 
-        embedding = model.predict(img_array, verbose=0)[0]
+    try:
+        batch = np.stack([array for _, array in loaded])
+        batch = tf.keras.applications.mobilenet_v2.preprocess_input(batch)
+        embeddings = model.predict(batch, verbose=0)
         # Normalizar el embedding (norma L2) para consistencia con la similitud de coseno
-        embedding = embedding / (np.linalg.norm(embedding) + 1e-8)
-        return embedding
+        embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8)
     except Exception as e:
-        print(f"Error procesando la imagen {image_path}: {e}")
-        return np.array([])
+        print(f"Error generando embeddings para un lote de {len(loaded)} imágenes: {e}")
+        return results
+
+    for (position, _), embedding in zip(loaded, embeddings):
+        results[position] = embedding
+    return results
+
 
+def iter_products_from_supabase(client: Client, page_size: int = 1000) -> Iterator[dict[str, Any]]:
+    """Recorre los productos activos (id y código) en páginas ordenadas por id.
 
-def get_products_from_supabase(client: Client) -> list[dict[str, Any]]:
-    """Obtiene la lista de productos (id y código) de Supabase."""
+    Usa paginación por clave (``id > último_id``) en lugar de offsets, así cada
+    página cuesta lo mismo. PostgREST recorta cada respuesta a su ``max-rows``
+    (1000 por defecto en Supabase) aunque se pida más, por lo que una página corta
+    no indica el final: solo se termina al recibir una página vacía.
+    """
     print("Obteniendo productos desde Supabase...")
-    response = client.from_("productos").select("id, codigo").eq("estado", "activo").execute()
-    if response.data:
-        print(f"Se encontraron {len(response.data)} productos activos.")
-        return response.data
-    print("No se encontraron productos o hubo un error.")
-    return []
+    last_id: Any = None
+    total = 0
+    while True:
+        query = client.from_("productos").select("id, codigo").eq("estado", "activo")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        response = query.order("id").limit(page_size).execute()
+        rows = response.data or []
+        if not rows:
+            break
+        yield from rows
+        total += len(rows)
+        last_id = rows[-1]["id"]
+    print(f"Se encontraron {total} productos activos.")
+
+
+def scan_image_folders(images_dir: pathlib.Path) -> dict[str, list[pathlib.Path]]:
+    """Construye el mapa código de producto -> imágenes con un único recorrido del directorio."""
+    folders: dict[str, list[pathlib.Path]] = {}
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            with os.scandir(entry.path) as files:
+                images = sorted(
+                    pathlib.Path(f.path)
+                    for f in files
+                    if f.is_file() and os.path.splitext(f.name)[1].lower() in IMAGE_EXTENSIONS
+                )
+            if images:
+                folders[entry.name] = images
+    return folders
+
+
+def staged(source: Iterable[T], maxsize: int) -> Iterator[T]:
+    """Ejecuta ``source`` en un hilo y entrega sus elementos a través de una cola acotada.
+
+    Encadenar varias etapas permite solapar descarga, inferencia y subida; la cola
+    acotada aplica contrapresión para que ninguna etapa acumule más de ``maxsize``
+    elementos en memoria.
+    """
+    done = object()
+    items: queue.Queue = queue.Queue(maxsize=maxsize)
+    errors: list[BaseException] = []
+
+    def produce() -> None:
+        try:
+            for item in source:
+                items.put(item)
+        except BaseException as exc:  # pragma: no cover
+            errors.append(exc)
+        finally:
+            items.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        item = items.get()
+        if item is done:
+            break
+        yield item
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def iter_image_jobs(
+    products: Iterable[dict[str, Any]],
+    folders: dict[str, list[pathlib.Path]],
+) -> Iterator[tuple[Any, str, pathlib.Path]]:
+    """Cruza los productos con el mapa de carpetas y emite (id, código, imagen)."""
+    for product in products:
+        product_id = product.get("id")
+        product_code = product.get("codigo")
+        if not product_id or not product_code:
+            continue
+        for image_path in folders.get(str(product_code), ()):
+            yield product_id, str(product_code), image_path
+
+
+def iter_embedding_batches(
+    model: tf.keras.Model,
+    jobs: Iterable[tuple[Any, str, pathlib.Path]],
+    batch_size: int,
+) -> Iterator[list[tuple[Any, str, pathlib.Path, np.ndarray]]]:
+    """Agrupa los trabajos en lotes y emite sus embeddings lote a lote."""
+
+    def flush(pending: list[tuple[Any, str, pathlib.Path]]) -> list[tuple[Any, str, pathlib.Path, np.ndarray]]:
+        embeddings = generate_embeddings(model, [path for _, _, path in pending])
+        return [(*job, embedding) for job, embedding in zip(pending, embeddings)]
+
+    pending: list[tuple[Any, str, pathlib.Path]] = []
+    for job in jobs:
+        pending.append(job)
+        if len(pending) >= batch_size:
+            yield flush(pending)
+            pending = []
+    if pending:
+        yield flush(pending)
 
 
 def upload_embedding(
@@ -120,37 +245,45 @@ def main(args: argparse.Namespace) -> None:
     """Función principal del script."""
     supabase_client = get_supabase_client()
     embedding_model = load_embedding_model(args.model_path)
-    products = get_products_from_supabase(supabase_client)
-    images_dir = args.images_dir
+    folders = scan_image_folders(args.images_dir)
+    print(f"Se encontraron carpetas de imágenes para {len(folders)} códigos de producto.")
 
-    if not products:
-        print("No hay productos para procesar. Saliendo.")
+    if not folders:
+        print("No hay imágenes para procesar. Saliendo.")
         return
 
-    processed_count = 0
-    for product in products:
-        product_id = product.get("id")
-        product_code = product.get("codigo")
-
-        if not product_id or not product_code:
-            continue
-
-        product_image_folder = images_dir / str(product_code)
-        if not product_image_folder.exists() or not product_image_folder.is_dir():
-            # print(f"No se encontró la carpeta de imágenes para el producto {product_code}, se omite.")
-            continue
-
-        print(f"\nProcesando producto: {product_code} (ID: {product_id})")
-        image_files = [
-            p for p in product_image_folder.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png")
-        ]
-
-        if not image_files:
-            print("  No se encontraron imágenes en la carpeta.")
-            continue
+    products = staged(iter_products_from_supabase(supabase_client, args.page_size), args.queue_size * args.page_size)
+    jobs = staged(iter_image_jobs(products, folders), args.queue_size * args.batch_size)
+    batches = staged(iter_embedding_batches(embedding_model, jobs, args.batch_size), args.queue_size)
+
+    if args.engine == "async":
+        rows = (
+            {"productoId": product_id, "embedding": embedding.tolist(), "fuente": image_path.name}
+            for batch in batches
+            for product_id, _, image_path, embedding in batch
+            if embedding.any()
+        )
+        uploader = AsyncUploader(
+            SUPABASE_URL,
+            SUPABASE_KEY,
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+            initial_batch_size=args.upload_batch_size,
+        )
+        summary = asyncio.run(uploader.upload(iterate_in_thread(rows)))
+        print(
+            f"\nProceso completado. Se subieron {summary['rows']} embeddings"
+            f" ({summary['failed_rows']} fallidos) en {summary['requests']} peticiones."
+        )
+        return
 
-        for image_path in image_files:
-            embedding = generate_embedding(embedding_model, image_path)
+    processed_count = 0
+    current_product = None
+    for batch in batches:
+        for product_id, product_code, image_path, embedding in batch:
+            if product_id != current_product:
+                print(f"\nProcesando producto: {product_code} (ID: {product_id})")
+                current_product = product_id
             if embedding.any():
                 upload_embedding(supabase_client, product_id, embedding, image_path.name)
                 processed_count += 1
@@ -172,6 +305,23 @@ if __name__ == "__main__":
         required=True,
         help="Ruta al archivo del modelo Keras (.h5 o .keras) a usar para los embeddings.",
     )
+    parser.add_argument("--page_size", type=int, default=1000, help="Productos por página al consultar Supabase.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Imágenes por lote de inferencia.")
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=4,
+        help="Lotes máximos en vuelo entre etapas (limita la memoria del pipeline).",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("sync", "async"),
+        default="sync",
+        help="'async' sube en lotes concurrentes con conexiones reutilizadas y límite de tasa.",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Peticiones simultáneas (motor async).")
+    parser.add_argument("--rate_limit", type=float, default=0.0, help="Peticiones por segundo, 0 = sin límite (motor async).")
+    parser.add_argument("--upload_batch_size", type=int, default=50, help="Filas iniciales por petición (motor async).")
     # Podríamos añadir más argumentos, como --overwrite, etc.
 
     args = parser.parse_args()